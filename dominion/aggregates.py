@@ -0,0 +1,94 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import functools
+import numpy as np
+
+# default maximum relative error of length statistics derived from a LengthSketch
+SKETCH_ERROR = 0.005
+
+class LengthSketch():
+	'''Histogram of read lengths with logarithmically spaced bins. Each bin holds the number
+	of reads and the sum of their lengths, therefore sketches of different reads can be merged
+	by adding up their bins. The bin with key k holds the lengths in (gamma^(k-1), gamma^k] with
+	gamma = (1 + e) / (1 - e), such that each length lies within the relative error e of the bin's
+	midpoint 2 gamma^k / (gamma + 1).'''
+	def __init__(self, relative_error=SKETCH_ERROR, keys=None, counts=None, sums=None):
+		self.relative_error = relative_error
+		self.gamma = (1. + relative_error) / (1. - relative_error)
+		self.log_gamma = math.log(self.gamma)
+		self.keys = np.array(keys if keys is not None else [], dtype=np.int64)
+		self.counts = np.array(counts if counts is not None else [], dtype=np.int64)
+		self.sums = np.array(sums if sums is not None else [], dtype=float)
+
+	@classmethod
+	def from_lengths(cls, lengths, relative_error=SKETCH_ERROR):
+		sketch = cls(relative_error)
+		lengths = np.asarray(lengths, dtype=float)
+		if lengths.size:
+			# lengths below 1 are all assigned to the bin of 1
+			keys = np.ceil(np.log(np.maximum(lengths, 1.)) / sketch.log_gamma).astype(np.int64)
+			sketch.keys, inverse = np.unique(keys, return_inverse=True)
+			sketch.counts = np.bincount(inverse).astype(np.int64)
+			sketch.sums = np.bincount(inverse, weights=lengths)
+		return sketch
+
+	@classmethod
+	def from_record(cls, record):
+		return cls(record['relative_error'], record['keys'], record['counts'], record['sums'])
+
+	def to_record(self):
+		return {'relative_error'	:	self.relative_error,
+				'keys'				:	self.keys.tolist(),
+				'counts'			:	self.counts.tolist(),
+				'sums'				:	self.sums.tolist()}
+
+	def __add__(self, other):
+		if self.relative_error != other.relative_error:
+			raise ValueError('sketches with different relative errors can not be merged')
+		keys, inverse = np.unique(np.concatenate([self.keys, other.keys]), return_inverse=True)
+		return LengthSketch(self.relative_error,
+							keys,
+							np.bincount(inverse, weights=np.concatenate([self.counts, other.counts]), minlength=keys.size).astype(np.int64),
+							np.bincount(inverse, weights=np.concatenate([self.sums, other.sums]), minlength=keys.size))
+
+	@property
+	def size(self):
+		return int(self.counts.sum())
+
+	def midpoint(self, i):
+		'''Returns the value that approximates all lengths of bin i within the relative error.'''
+		return 2. * self.gamma ** self.keys[i] / (self.gamma + 1.)
+
+	def median(self):
+		'''Approximates the median read length by the midpoint of the bin containing the median.'''
+		if not self.size:
+			return np.nan
+		i = np.searchsorted(np.cumsum(self.counts), self.size / 2.)
+		return self.midpoint(i)
+
+	def mean_longest_half(self):
+		'''Approximates the mean length of the longest half of all reads. Only the lengths of
+		reads in the shortest bin that partially belongs to the longest half are approximated, by
+		the midpoint of the bin.'''
+		n = self.size // 2
+		if not n:
+			return np.nan
+		counts, sums = self.counts[::-1], self.sums[::-1]
+		i = np.searchsorted(np.cumsum(counts), n)
+		remaining = n - counts[:i].sum()
+		return (sums[:i].sum() + remaining * self.midpoint(len(counts) - 1 - i)) / n
+
+def merge_sketches(sketches):
+	return functools.reduce(lambda a, b: a + b, sketches)
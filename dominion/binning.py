@@ -0,0 +1,105 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+def get_lowest_possible_interval(intervals, max_bins, min_value, max_value):
+	interval = None
+	num_bins = None
+	for interval in intervals:
+		offset = min_value // interval
+		num_bins = ((max_value-(offset*interval)) // interval)+1
+		if num_bins <= max_bins:
+			interval = interval
+			break
+	if not interval:
+		interval = intervals[-1]
+	return interval, offset, int(num_bins)
+
+class Binning():
+	'''Assigns values to num_bins bins of size interval. Bin i contains all values x with
+	(offset+i)*interval <= x < (offset+i+1)*interval, such that the bins are aligned to
+	multiples of interval.'''
+	def __init__(self, values, interval, offset, num_bins):
+		self.interval = interval
+		self.offset = offset
+		self.num_bins = num_bins
+		indices = np.floor(np.asarray(values) / interval) - offset
+		self.indices = np.clip(indices, 0, num_bins-1).astype(np.int64)
+		self.counts = np.bincount(self.indices, minlength=num_bins)
+		self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+	@classmethod
+	def from_intervals(cls, values, intervals, max_bins):
+		'''Uses the smallest of the given intervals that results in at most max_bins bins.'''
+		interval, offset, num_bins = get_lowest_possible_interval(intervals, max_bins, np.min(values), np.max(values))
+		return cls(values, interval, offset, num_bins)
+
+	@property
+	def lower_edges(self):
+		return (self.offset + np.arange(self.num_bins)) * self.interval
+
+	def sums(self, weights):
+		return np.bincount(self.indices, weights=weights, minlength=self.num_bins)
+
+	def sort(self, values):
+		'''Returns the given values ordered by bin and by value within each bin.'''
+		values = np.asarray(values)
+		return values[np.lexsort((values, self.indices))]
+
+	def quantiles(self, values, qs, sorted_values=None):
+		'''Calculates the quantiles qs of the given values for each bin, interpolating linearly
+		like numpy.percentile. Returns an array of shape (len(qs), num_bins) that is NaN
+		for empty bins.'''
+		if sorted_values is None:
+			sorted_values = self.sort(values)
+		result = np.full((len(qs), self.num_bins), np.nan)
+		filled = self.counts > 0
+		starts, counts = self.starts[filled], self.counts[filled]
+		for i, q in enumerate(qs):
+			pos = starts + q * (counts - 1)
+			lower = np.floor(pos).astype(np.int64)
+			upper = np.ceil(pos).astype(np.int64)
+			result[i, filled] = sorted_values[lower] + (pos - lower) * (sorted_values[upper] - sorted_values[lower])
+		return result
+
+	def box_stats(self, values, whis=1.5):
+		'''Calculates the statistics of a box plot of the given values for each bin in the form
+		expected by matplotlib.axes.Axes.bxp. Whiskers extend to the most extreme values within 
+		whis times the interquartile range from the box, like in matplotlib.axes.Axes.boxplot.'''
+		sorted_values = self.sort(values)
+		q1, med, q3 = self.quantiles(values, [.25, .5, .75], sorted_values)
+		stats = []
+		for i in range(self.num_bins):
+			stat = {'q1':q1[i], 'med':med[i], 'q3':q3[i], 'whislo':np.nan, 'whishi':np.nan, 
+					'fliers':np.array([]), 'count':int(self.counts[i])}
+			if self.counts[i]:
+				bin_values = sorted_values[self.starts[i]:self.starts[i]+self.counts[i]]
+				iqr = q3[i] - q1[i]
+				lo = np.searchsorted(bin_values, q1[i] - whis*iqr, side='left')
+				hi = np.searchsorted(bin_values, q3[i] + whis*iqr, side='right') - 1
+				stat['whislo'] = bin_values[lo] if lo < bin_values.size and bin_values[lo] <= q1[i] else q1[i]
+				stat['whishi'] = bin_values[hi] if hi >= 0 and bin_values[hi] >= q3[i] else q3[i]
+			stats.append(stat)
+		return stats
+
+def cumulative_curve(values, end, num_points, weights=None):
+	'''Samples the cumulative count of values, or the cumulative sum of their weights, at
+	num_points evenly spaced positions from 0 to end. Returns the positions and the sampled 
+	sums, starting with the first position that is reached by any value.'''
+	positions = np.linspace(0., end, num_points)
+	# each value is added at the first position that is not lower than the value
+	indices = np.minimum(np.searchsorted(positions, values, side='left'), num_points-1)
+	sums = np.cumsum(np.bincount(indices, weights=weights, minlength=num_points))
+	first = indices.min() if indices.size else 0
+	return positions[first:], sums[first:]
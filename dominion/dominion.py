@@ -18,12 +18,14 @@ import time
 from watchdog.observers import Observer
 from watchdog.events import LoggingEventHandler
 from watchdog.events import FileSystemEventHandler
-#import multiprocessing as mp
+import multiprocessing as mp
 from collections import OrderedDict
 import re
 import copy
 import json
 import subprocess
+import signal
+import itertools
 #import sched
 import webbrowser
 from shutil import copyfile, which
@@ -33,21 +35,26 @@ from operator import itemgetter
 from .version import __version__
 from .statsparser import get_argument_parser as sp_get_argument_parser
 from .statsparser import parse_args as sp_parse_args
-from .helper import initLogger, resources_dir, get_script_dir, hostname, ArgHelpFormatter, r_file, r_dir, rw_dir, defaults, jinja_env
+from . import statsparser
+from .minknowlog import EventDispatcher, parse_timestamp, KEY_VALUE_PATTERN, ACTIVE_PORES_PATTERN, PORES_IN_USE_PATTERN, \
+					   ATTRIBUTE_PATTERN, PROTOCOL_ARGUMENT_PATTERN, CONTEXT_TAG_PATTERN
+from .rundb import RunDatabase, DB_NAME, LOGDATA_SUFFIX
+from .transfer import TransferScheduler, PRIORITY_STATS, PRIORITY_READS, MANIFEST_SUFFIX, read_progress
+from .helper import initLogger, resources_dir, hostname, ArgHelpFormatter, r_file, r_dir, rw_dir, defaults, jinja_env
 import threading
 import logging
 import queue
 from pathlib import Path
 from jinja2 import Environment, PackageLoader, select_autoescape
 
-ALL_RUNS = {}
-ALL_RUNS_LOCK = threading.RLock()
+RUN_DB = None
 SP_DIRS = {}
 SP_DIRS_LOCK = threading.RLock()
-MUX_RESULTS = {}
-MUX_RESULTS_LOCK = threading.RLock()
 UPDATE_OVERVIEW = False
 UPDATE_OVERVIEW_LOCK = threading.RLock()
+# events processed by the main loop, either ('log', channel) for new log lines of a channel
+# or ('overview', None) for updating the overview page
+EVENTS = queue.Queue()
 logger = None
 
 class parse_statsparser_args(argparse.Action):
@@ -103,6 +110,19 @@ def parse_args():
 							   default="{}".format(defaults()["identity"]),
 							   help='''file from which the identity (private key) for public key authentication is read.
 							           Default value is parsed from setting file {}'''.format(os.path.join(resources_dir, "defaults.ini")))
+	general_group.add_argument('--transfer_interval',
+							   type=int,
+							   default=60,
+							   help='''time interval in seconds in which processed files of all flowcells are 
+							           transferred to the rsync destination''')
+	general_group.add_argument('--bwlimit',
+							   type=int,
+							   default=0,
+							   help='''bandwidth limit for the transfer of processed files in KiB/s, 0 for no limit''')
+	general_group.add_argument('--transfer_checksums',
+							   action='store_true',
+							   help='''store xxhash checksums of transferred files in the transfer manifest of each run
+							           (requires the python module xxhash)''')
 	general_group.add_argument('--bc_kws',
 							   nargs='*',
 							   default=['RBK', 'NBD', 'RAB', 'LWB', 'PBK', 'RPB', 'arcod'],
@@ -112,6 +132,19 @@ def parse_args():
 							   type=int,
 							   default=300,
 							   help='minimum time interval in seconds for updating the content of a report page')
+	general_group.add_argument('-j', '--batch_jobs',
+							   type=int,
+							   default=1,
+							   help='''maximum number of fastq batches per flowcell that watchnchop processes concurrently''')
+	general_group.add_argument('-w', '--report_workers',
+							   type=int,
+							   default=2,
+							   help='number of worker processes that create report pages in the background')
+	general_group.add_argument('--overview_runs',
+							   type=int,
+							   default=500,
+							   help='''maximum number of the most recent sequencing runs listed on the overview page, 
+							           0 for all runs''')
 	general_group.add_argument('-m', '--ignore_file_modifications',
 							   action='store_true',
 							   help='''Ignore file modifications and only consider file creations regarding 
@@ -181,6 +214,7 @@ def parse_args():
 	#args.watchnchop_args.extend(['-l', str(args.min_length)])
 	#args.watchnchop_args.extend(['-r', str(args.min_length_rna)])
 	args.watchnchop_args.extend(['-q', str(args.min_quality)])
+	args.watchnchop_args.extend(['-j', str(args.batch_jobs)])
 	args.watchnchop_args.extend(['-d', args.rsync_dest])
 	args.watchnchop_args.extend(['-i', args.identity_file])
 
@@ -188,8 +222,7 @@ def parse_args():
 
 
 def main(args):
-	global ALL_RUNS
-	global ALL_RUNS_LOCK
+	global RUN_DB
 	global UPDATE_OVERVIEW
 	global logger
 
@@ -222,8 +255,15 @@ def main(args):
 		copyfile(os.path.join(resources_dir, res_file), 
 				 os.path.join(args.output_dir, 'res', res_file))
 
-	import_qcs(os.path.join(args.output_dir, "qc"))
-	import_runs(os.path.join(args.output_dir, "runs"))
+	logger.info("starting {} report worker processes".format(args.report_workers))
+	report_pool = ReportWorkerPool(max(args.report_workers, 1))
+	report_pool.start()
+
+	logger.info("synchronizing run database with the logdata files in {}".format(args.output_dir))
+	RUN_DB = RunDatabase(os.path.join(args.output_dir, DB_NAME),
+						 os.path.join(args.output_dir, "runs"),
+						 os.path.join(args.output_dir, "qc"))
+	RUN_DB.sync()
 
 	logger.info("starting to observe runs directory for changes to directory names")
 	observed_dir = os.path.join(args.output_dir, 'runs')
@@ -234,6 +274,14 @@ def main(args):
 					  recursive=True)
 	observer.start()
 
+	transfer_scheduler = None
+	if not args.no_transfer:
+		logger.info("starting transfer scheduler")
+		transfer_scheduler = TransferScheduler(args.rsync_dest, args.identity_file, args.transfer_interval, args.bwlimit, 
+											   args.transfer_checksums, set_update_overview)
+		transfer_scheduler.resume(os.path.join(args.output_dir, 'runs'))
+		transfer_scheduler.start()
+
 	logger.info("starting channel watchers:")
 	watchers = []
 	for channel in range(5):
@@ -247,25 +295,32 @@ def main(args):
 								args.watchnchop_args,
 								args.min_length,
 								args.min_length_rna,
-								args.bc_kws))
+								args.bc_kws,
+								report_pool,
+								transfer_scheduler))
 
 	logger.info("initiating dominION overview page")
-	update_overview(watchers, args.output_dir)
+	update_overview(watchers, args.output_dir, args.overview_runs)
 	webbrowser.open('file://' + os.path.realpath(os.path.join(args.output_dir, "{}_overview.html".format(hostname))))
 	logger.info("entering main loop")
 	try:
-		n = 0
 		while True:
+			# block until the next event, then process all events that arrived in the meantime
+			events = [EVENTS.get()]
+			while True:
+				try:
+					events.append(EVENTS.get_nowait())
+				except queue.Empty:
+					break
+			channels = set(channel for kind, channel in events if kind == 'log')
 			for watcher in watchers:
-				watcher.check_q()
-			if UPDATE_OVERVIEW:
-				update_overview(watchers, args.output_dir)
+				if watcher.channel in channels:
+					watcher.check_q()
+			with UPDATE_OVERVIEW_LOCK:
+				update = UPDATE_OVERVIEW
 				UPDATE_OVERVIEW = False
-			time.sleep(0.2)
-			n += 1
-			if n == 100:
-				n = 0
-				set_update_overview()
+			if update:
+				update_overview(watchers, args.output_dir, args.overview_runs)
 	except KeyboardInterrupt:
 		for watcher in watchers:
 			watcher.observer.stop()
@@ -285,140 +340,32 @@ def main(args):
 		if watcher.spScheduler.is_alive() if watcher.spScheduler else None:
 			logger.info("joining GA{}0000's statsparser scheduler".format(watcher.channel))
 			watcher.stop_statsparser()
+	if transfer_scheduler:
+		logger.info("transferring remaining files and stopping transfer scheduler")
+		transfer_scheduler.join()
+	logger.info("stopping report worker processes")
+	report_pool.stop()
+	logger.info("handled log events: {}".format(dict(SERVER_LOG_EVENTS.counts + BREAM_LOG_EVENTS.counts)))
+
+def get_transfer_status(manifest_fp):
+	progress = read_progress(manifest_fp)
+	if not progress:
+		return "N/A"
+	confirmed, total, archived = progress
+	if archived and confirmed == total:
+		return "complete"
+	return "{:.0f}% of {:.1f} GB".format(100. * confirmed / total if total else 100., total / 1e9)
 
 def set_update_overview():
 	global UPDATE_OVERVIEW
-	UPDATE_OVERVIEW_LOCK.acquire()
-	UPDATE_OVERVIEW = True
-	UPDATE_OVERVIEW_LOCK.release()
-
-def add_database_entry(flowcell, run_data, mux_scans):
-	ALL_RUNS_LOCK.acquire()
-	#TODO: check for all mandatory entries
-	asic_id_eeprom = flowcell['asic_id_eeprom']
-	run_id = run_data['run_id']
-	if asic_id_eeprom in ALL_RUNS:
-		if run_id in ALL_RUNS[asic_id_eeprom]:
-			logger.warning("{} exists multiple times in database!".format(run_id))
-			logger.warning("conflicting runs: {}, {}".format(ALL_RUNS[asic_id_eeprom][run_id]['run_data']['relative_path'],
-															 run_data['relative_path']))
-			ALL_RUNS_LOCK.release()
-			return False
-	else:
-		ALL_RUNS[asic_id_eeprom] = {}
-	
-	ALL_RUNS[asic_id_eeprom][run_id] = {'flowcell'	: flowcell,
-										'run_data'	: run_data,
-										'mux_scans'	: mux_scans}
-	logger.debug('{} - added experiment of type "{}" performed on flowcell "{}" on "{}"'.format(asic_id_eeprom, 
-																								run_data['experiment_type'], 
-																								flowcell['flowcell_id'], 
-																								run_data['protocol_start']))
-	ALL_RUNS_LOCK.release()
-	return True
-
-def add_mux_scan_results(flowcell_data, mux_scans):
-	MUX_RESULTS_LOCK.acquire()
-	asic_id_eeprom = flowcell_data['asic_id_eeprom']
-	flowcell_id = flowcell_data['flowcell_id']
-	if asic_id_eeprom not in MUX_RESULTS:
-		MUX_RESULTS[asic_id_eeprom] = []
-	for mux_scan in mux_scans:
-		mux_scan_copy = copy.deepcopy(mux_scan)
-		if not 'total' in mux_scan:
-			if 'group * total' in mux_scan:
-				mux_scan_copy['total'] = mux_scan['group * total']
-				del mux_scan_copy['group * total']
-			else:
-				continue
-		mux_scan_copy['flowcell_id'] = flowcell_id
-		mux_scan_copy['timestamp'] = dateutil.parser.parse(mux_scan['timestamp'])
-		for i in range(len(MUX_RESULTS[asic_id_eeprom])):
-			if mux_scan_copy['timestamp'] < MUX_RESULTS[asic_id_eeprom][i]['timestamp']:
-				MUX_RESULTS[asic_id_eeprom].insert(i, mux_scan_copy)
-				break
-		else:
-			MUX_RESULTS[asic_id_eeprom].append(mux_scan_copy)
-	MUX_RESULTS_LOCK.release()
-
-def import_qcs(qc_dir):
-	logger.info("importing platform qc entries from files in directory {}".format(qc_dir))
-	for fp in [os.path.join(qc_dir, fn) for fn in os.listdir(qc_dir) if fn.endswith('.json')]:
-		if os.path.isfile(fp):
-			with open(fp, "r") as f:
-				try:
-					flowcell, run_data, mux_scans = json.loads(f.read(), object_pairs_hook=OrderedDict)
-				except:
-					logger.warning("failed to parse {}, json format or data structure corrupt".format(fn))
-					continue
-			asic_id_eeprom = flowcell['asic_id_eeprom']
-			add_mux_scan_results(flowcell, mux_scans)
-
-def import_runs(base_dir, refactor=False):
-	logger.info("importing sequencing run entries from files in directory {}".format(base_dir))
-	for experiment in [d for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d))]:
-		experiment_dir = os.path.join(base_dir, experiment)
-		for sample in [d for d in os.listdir(experiment_dir) if os.path.isdir(os.path.join(experiment_dir, d))]:
-			sample_dir = os.path.join(experiment_dir, sample)
-			for fp in [os.path.join(sample_dir, fn) for fn in os.listdir(sample_dir) if fn.endswith('.json')]:
-				if os.path.isfile(fp):
-					with open(fp, "r") as f:
-						try:
-							flowcell, run_data, mux_scans = json.loads(f.read(), object_pairs_hook=OrderedDict)
-						except:
-							logger.warning("failed to parse {}, json format or data structure corrupt".format(fn))
-							continue
-					# temporarily change attributes experiment and sample according to directory names
-					prev = (run_data['experiment'] if 'experiment' in run_data else None, 
-							run_data['sample'] if 'sample' in run_data else None)
-					changed = prev == (experiment, sample)
-					run_data['experiment'] = experiment
-					run_data['sample'] = sample
-					if refactor and changed:
-						# make changes permanent
-						logging.info("writing changes to attributes 'experiment' and 'sample' to file")
-						data = (flowcell, run_data, mux_scans)
-						with open( fp, 'w') as f:
-							print(json.dumps(data, indent=4), file=f)
-					
-					if not add_database_entry(flowcell, run_data, mux_scans):
-						logger.error("failed to add content from {} to the database".format(fp))
-						continue
-					# add mux scans
-					add_mux_scan_results(flowcell, mux_scans)
-
-def get_runs_by_flowcell(asic_id_eeprom):
-	ALL_RUNS_LOCK.acquire()
-	runs = {}
-	if asic_id_eeprom:
-		if asic_id_eeprom in ALL_RUNS:
-			for run_id in ALL_RUNS[asic_id_eeprom]:
-				if 'qc' not in ALL_RUNS[asic_id_eeprom][run_id]['run_data']['experiment_type'].lower():
-					runs[run_id] = ALL_RUNS[asic_id_eeprom][run_id]
-	ALL_RUNS_LOCK.release()
-	return runs
-
-def get_latest_mux_scan_result(asic_id_eeprom):
-	latest_result = None
-	MUX_RESULTS_LOCK.acquire()
-	if asic_id_eeprom in MUX_RESULTS:
-		latest_result =  MUX_RESULTS[asic_id_eeprom][0]
-	MUX_RESULTS_LOCK.release()
-	return latest_result
-
-def get_latest(runs):
-	latest_qc = None
-	for run_id in runs:
-		if latest_qc:
-			_protocol_start = dateutil.parser.parse(runs[latest_qc]['run_data']['protocol_start'])
-			if protocol_start > _protocol_start:
-				latest_qc = run_id
-		else:
-			latest_qc = run_id
-			protocol_start = dateutil.parser.parse(runs[run_id]['run_data']['protocol_start'])
-	return latest_qc
+	with UPDATE_OVERVIEW_LOCK:
+		# requests are coalesced until the main loop updated the overview page
+		if UPDATE_OVERVIEW:
+			return
+		UPDATE_OVERVIEW = True
+	EVENTS.put( ('overview', None) )
 
-def update_overview(watchers, output_dir):
+def update_overview(watchers, output_dir, max_runs=0):
 	channel_to_css = {0:"one", 1:"two", 2:"three", 3:"four", 4:"five"}
 	render_dict = {"version"		:	__version__,
 				   "dateTimeNow"	:	datetime.now().strftime("%Y-%m-%d_%H:%M"),
@@ -434,11 +381,11 @@ def update_overview(watchers, output_dir):
 		except:
 			pass
 
-		runs = get_runs_by_flowcell(asic_id_eeprom)
+		runs = RUN_DB.get_runs_by_flowcell(asic_id_eeprom)
 		#qcs  = get_qcs_by_flowcell(asic_id_eeprom)
 
 		render_dict["channels"][channel]['latest_qc'] = {}
-		latest_qc = get_latest_mux_scan_result(asic_id_eeprom)
+		latest_qc = RUN_DB.get_latest_mux_scan_result(asic_id_eeprom)
 		if latest_qc:
 			render_dict["channels"][channel]['latest_qc']['timestamp'] 	= latest_qc['timestamp'].date()
 			render_dict["channels"][channel]['latest_qc']['total'] 		= latest_qc['total']
@@ -472,35 +419,31 @@ def update_overview(watchers, output_dir):
 		else:	
 			render_dict["channels"][channel]['flowcell_id'] = '-'
 
-	ALL_RUNS_LOCK.acquire()
 	all_runs_info = []
-	for asic_id_eeprom in ALL_RUNS:
-		for run_id in ALL_RUNS[asic_id_eeprom]:
-			experiment_type = ALL_RUNS[asic_id_eeprom][run_id]['run_data']['experiment_type']
-			if not 'qc' in experiment_type.lower():
-				protocol_start = dateutil.parser.parse(ALL_RUNS[asic_id_eeprom][run_id]['run_data']['protocol_start'])
-				duration = "N/A"
-				if 'protocol_end' in ALL_RUNS[asic_id_eeprom][run_id]['run_data']:
-					if ALL_RUNS[asic_id_eeprom][run_id]['run_data']['protocol_end']:
-						protocol_end = dateutil.parser.parse(ALL_RUNS[asic_id_eeprom][run_id]['run_data']['protocol_end'])
-						duration = "{}".format(protocol_end - protocol_start).split('.')[0]
-				sequencing_kit = ALL_RUNS[asic_id_eeprom][run_id]['run_data']['sequencing_kit']
-				experiment = ALL_RUNS[asic_id_eeprom][run_id]['run_data']['experiment']
-				sample = ALL_RUNS[asic_id_eeprom][run_id]['run_data']['sample']
-				if not sample:
-					sample = experiment
-				link = os.path.abspath(os.path.join(output_dir,'runs',experiment,sample,'report.html'))
-				all_runs_info.append({'link':link,
-									  'experiment':experiment,
-									  'sample': sample,
-									  'sequencing_kit': sequencing_kit,
-									  'protocol_start': protocol_start,
-									  'duration': duration})
-	ALL_RUNS_LOCK.release()
+	# runs are sorted by protocol start in the database, newest first
+	for run_id, run_data in RUN_DB.get_runs(max_runs):
+		protocol_start = parse_timestamp(run_data['protocol_start'])
+		duration = "N/A"
+		if 'protocol_end' in run_data:
+			if run_data['protocol_end']:
+				protocol_end = parse_timestamp(run_data['protocol_end'])
+				duration = "{}".format(protocol_end - protocol_start).split('.')[0]
+		sequencing_kit = run_data['sequencing_kit']
+		experiment = run_data['experiment']
+		sample = run_data['sample']
+		if not sample:
+			sample = experiment
+		link = os.path.abspath(os.path.join(output_dir,'runs',experiment,sample,'report.html'))
+		transfer = get_transfer_status(os.path.join(output_dir,'runs',experiment,sample,run_id + MANIFEST_SUFFIX))
+		all_runs_info.append({'link':link,
+							  'experiment':experiment,
+							  'sample': sample,
+							  'sequencing_kit': sequencing_kit,
+							  'protocol_start': protocol_start,
+							  'duration': duration,
+							  'transfer': transfer})
 
 	if all_runs_info:
-		all_runs_info = sorted(all_runs_info, key=lambda k: k['protocol_start'], reverse=True)
-
 		run = 0
 		sample = 0
 		grouped = [[[all_runs_info[0]]]] if all_runs_info else [[[]]]
@@ -596,7 +539,7 @@ class ChannelStatus():
 		self.mux_scans[-1]['total'] = active_pores
 		if in_use:
 			self.mux_scans[-1]['in_use'] = in_use
-		add_mux_scan_results(self.flowcell, [self.mux_scans[-1]])
+		RUN_DB.add_mux_scans(self.flowcell, [self.mux_scans[-1]])
 		self.logger.debug("added new mux scan result")
 
 	def flowcell_disconnected(self):
@@ -617,7 +560,8 @@ class ChannelStatus():
 
 class WatchnchopScheduler(threading.Thread):
 	def __init__(self, data_basedir, relative_path, experiment, sequencing_kit, fastq_reads_per_file,
-				 bc_kws, stats_fp, channel, watchnchop_args, min_length, min_length_rna):
+				 bc_kws, stats_fp, channel, watchnchop_args, min_length, min_length_rna, transfer_scheduler=None,
+				 manifest_fp=None):
 		threading.Thread.__init__(self)
 		if getattr(self, 'daemon', None) is None:
 			self.daemon = True
@@ -626,15 +570,34 @@ class WatchnchopScheduler(threading.Thread):
 		self.stoprequest = threading.Event()	# set when joined without timeout (eg if terminated with ctr-c)
 		self.exp_end = threading.Event()			# set when joined with timeout (eg if experiment ended)
 		self.logger = logging.getLogger(name='gw.w{}.wcs'.format(channel+1))
+		self.channel = channel
+		self.transfer_scheduler = transfer_scheduler
+		self.manifest_fp = manifest_fp
 
-		self.observed_dir = os.path.join(data_basedir, relative_path, 'fastq_pass')
+		self.run_dir = os.path.join(data_basedir, relative_path)
+		self.observed_dir = os.path.join(self.run_dir, 'fastq_pass')
+		self.fastq_dirs = ['fastq_pass'] if '-p' in watchnchop_args else ['fastq_pass', 'fastq_fail']
+		try:
+			self.fastq_reads_per_file = int(fastq_reads_per_file)
+		except (TypeError, ValueError):
+			self.fastq_reads_per_file = None
 		# define the command that is to be executed
-		self.cmd = [which('perl'),
+		self.cmd = [which('nice'), '-n', '19',
+					which('perl'),
 					which('watchnchop'),
 					'-o', stats_fp,
 					'-f', str(fastq_reads_per_file)]
 		if watchnchop_args:
 			self.cmd.extend(watchnchop_args)
+		# calculate read stats with the vectorized python engine if it is installed
+		if which('fastqstats'):
+			self.cmd.extend(['-e', which('fastqstats')])
+		# completed fastq files are detected by this thread and passed to watchnchop
+		if self.fastq_reads_per_file:
+			self.cmd.append('-s')
+		# processed files are transferred by the transfer scheduler of all flowcells
+		if self.transfer_scheduler:
+			self.cmd.append('-r')
 		for kw in bc_kws:
 			if kw.lower() in experiment.lower() or kw.lower() in sequencing_kit.lower():
 				self.cmd.append('-b')
@@ -644,25 +607,22 @@ class WatchnchopScheduler(threading.Thread):
 			self.cmd.append(str(min_length_rna))
 		else:
 			self.cmd.append(str(min_length))
-		self.cmd.append(os.path.join(data_basedir, relative_path, ''))
+		self.cmd.append(os.path.join(self.run_dir, ''))
 		self.process = None
+		self.observer = None
+		self.process_lock = threading.Lock()
 
 	def run(self):
 		self.logger.info("STARTED watchnchop scheduler")
 		while not (self.stoprequest.is_set() or self.exp_end.is_set()):
 			if self.conditions_met():
-				self.process = subprocess.Popen(self.cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=subprocess.IDLE_PRIORITY_CLASS)
-				self.logger.info("STARTED WATCHNCHOP with arguments: {}".format(self.cmd))
+				self.start_watchnchop()
 				break
 			time.sleep(1)
 		while not (self.stoprequest.is_set() or self.exp_end.is_set()):
 			time.sleep(1)
 		if self.process:
-			try:
-				self.process.terminate()
-				self.logger.info("TERMINATED watchnchop process")
-			except:
-				self.logger.error("TERMINATING watchnchop process failed")
+			self.stop_watchnchop()
 		else:
 			if self.stoprequest.is_set():
 				self.logger.error("watchnchop was NEVER STARTED: this thread was ordered to kill the watchnchop subprocess before it was started")
@@ -676,8 +636,7 @@ class WatchnchopScheduler(threading.Thread):
 					return
 				time.sleep(1)
 			if self.conditions_met():
-				self.process = subprocess.Popen(self.cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=subprocess.IDLE_PRIORITY_CLASS)
-				self.logger.info("STARTED WATCHNCHOP with arguments: {}".format(self.cmd))
+				self.start_watchnchop()
 			else:
 				self.logger.error("watchnchop NOT STARTED: directory {} still does not exist or contains no fastq files".format(self.observed_dir))
 				return
@@ -685,8 +644,59 @@ class WatchnchopScheduler(threading.Thread):
 				if self.stoprequest.is_set():
 					break
 				time.sleep(1)
+			self.stop_watchnchop()
+
+	def start_watchnchop(self):
+		stdin = subprocess.PIPE if self.fastq_reads_per_file else None
+		stdout = subprocess.PIPE if self.transfer_scheduler else subprocess.DEVNULL
+		self.process = subprocess.Popen(self.cmd, stdin=stdin, stdout=stdout, stderr=subprocess.DEVNULL)
+		self.logger.info("STARTED WATCHNCHOP with arguments: {}".format(self.cmd))
+		if self.transfer_scheduler:
+			reader = threading.Thread(target=self.queue_transfers)
+			reader.daemon = True
+			reader.start()
+		if not self.fastq_reads_per_file:
+			# watchnchop needs to look for completed files itself
+			return
+		event_handler = FastqBatchEventHandler(self.run_dir, self.fastq_dirs, self.fastq_reads_per_file, 
+											   self.announce_file, self.channel)
+		self.observer = Observer()
+		self.observer.schedule(event_handler, 
+							   self.run_dir, 
+							   recursive=True)
+		self.observer.start()
+		# count the files that were written before the observer was started
+		event_handler.scan()
+
+	def announce_file(self, relative_fp):
+		'''passes a completed fastq file to watchnchop'''
+		self.logger.debug("announcing completed fastq file {}".format(relative_fp))
+		with self.process_lock:
+			try:
+				self.process.stdin.write('{}\n'.format(relative_fp).encode())
+				self.process.stdin.flush()
+			except (BrokenPipeError, ValueError):
+				self.logger.error("fastq file {} could not be passed to watchnchop".format(relative_fp))
+
+	def queue_transfers(self):
+		'''passes the files that watchnchop reports as processed to the transfer scheduler'''
+		for line in self.process.stdout:
+			line = line.decode(errors='replace').rstrip('\n')
+			if line.startswith('TRANSFER '):
+				fp = line[len('TRANSFER '):]
+				self.transfer_scheduler.queue(fp, PRIORITY_STATS if fp.endswith('.csv') else PRIORITY_READS, self.manifest_fp)
+			elif line.startswith('ARCHIVE '):
+				self.transfer_scheduler.queue_archive(line[len('ARCHIVE '):], self.manifest_fp)
+
+	def stop_watchnchop(self):
+		if self.observer:
+			self.observer.stop()
+			self.observer.join()
+		try:
 			self.process.terminate()
 			self.logger.info("TERMINATED watchnchop process")
+		except:
+			self.logger.error("TERMINATING watchnchop process failed")
 
 	def conditions_met(self):
 		if os.path.exists(self.observed_dir):
@@ -702,9 +712,75 @@ class WatchnchopScheduler(threading.Thread):
 		super(WatchnchopScheduler, self).join(timeout)
 
 
+class FastqBatchEventHandler(FileSystemEventHandler):
+	'''counts the lines of the fastq files in the fastq directories of a run while they 
+	are written. Only data appended since the last event is read. Files are passed to the
+	callback function as soon as they contain the expected number of reads.'''
+	fastq_pattern = re.compile(r'.+_.+_(\d+)\.fastq$')
+
+	def __init__(self, run_dir, fastq_dirs, reads_per_file, callback, channel):
+		super(FastqBatchEventHandler, self).__init__()
+		self.run_dir = os.path.abspath(run_dir)
+		self.fastq_dirs = fastq_dirs
+		self.lines_per_file = 4 * reads_per_file
+		self.callback = callback
+		self.counted = {}		# path : [bytes read, lines counted]
+		self.completed = set()
+		self.lock = threading.Lock()
+		self.logger = logging.getLogger(name='gw.w{}.fbeh'.format(channel+1))
+
+	def on_created(self, event):
+		if not event.is_directory:
+			self.count(event.src_path)
+
+	def on_modified(self, event):
+		if not event.is_directory:
+			self.count(event.src_path)
+
+	def on_moved(self, event):
+		if not event.is_directory:
+			self.count(event.dest_path)
+
+	def scan(self):
+		for fastq_dir in self.fastq_dirs:
+			path = os.path.join(self.run_dir, fastq_dir)
+			if os.path.isdir(path):
+				for entry in os.scandir(path):
+					if entry.is_file():
+						self.count(entry.path)
+
+	def count(self, path):
+		path = os.path.abspath(path)
+		fastq_dir, fn = os.path.split(path)
+		if os.path.dirname(fastq_dir) != self.run_dir or os.path.basename(fastq_dir) not in self.fastq_dirs:
+			return
+		if not self.fastq_pattern.match(fn):
+			return
+		with self.lock:
+			if path in self.completed:
+				return
+			counted = self.counted.setdefault(path, [0, 0])
+			try:
+				with open(path, 'rb') as f:
+					f.seek(counted[0])
+					data = f.read()
+			except OSError:
+				self.logger.debug("fastq file {} could not be read".format(path))
+				return
+			counted[0] += len(data)
+			counted[1] += data.count(b'\n')
+			if counted[1] < self.lines_per_file:
+				return
+			self.completed.add(path)
+			del self.counted[path]
+		self.logger.debug("fastq file {} is complete".format(path))
+		# watchnchop expects paths of the form pass/FILENAME or fail/FILENAME
+		self.callback('{}/{}'.format(os.path.basename(fastq_dir)[len('fastq_'):], fn))
+
+
 class StatsparserScheduler(threading.Thread):
 
-	def __init__(self, update_interval, sample_dir, statsparser_args, channel):
+	def __init__(self, update_interval, sample_dir, statsparser_args, channel, report_pool, report_callback=None):
 		threading.Thread.__init__(self)
 		if getattr(self, 'daemon', None) is None:
 			self.daemon = True
@@ -718,6 +794,8 @@ class StatsparserScheduler(threading.Thread):
 		self.update_interval = update_interval
 		self.sample_dir = sample_dir
 		self.statsparser_args = statsparser_args
+		self.report_pool = report_pool
+		self.report_callback = report_callback
 		self.page_opened = False
 
 	def run(self):
@@ -755,12 +833,14 @@ class StatsparserScheduler(threading.Thread):
 
 	def update_report(self):
 		self.logger.info("updating report...")
-		cmd = [os.path.join(get_script_dir(),'statsparser'), #TODO: change to which() ?
-			   self.sample_dir,
-			   '-q']
-		cmd.extend(self.statsparser_args)
-		cp = subprocess.run(cmd) # waits for process to complete
-		if cp.returncode == 0:
+		result = self.report_pool.run_job(self.sample_dir, self.statsparser_args, self.stoprequest)
+		if result is None:
+			self.logger.info("stopped waiting for the report of directory {}".format(self.sample_dir))
+			return
+		returncode, wall_time, cpu_time = result
+		if self.report_callback:
+			self.report_callback(self.sample_dir, returncode, wall_time, cpu_time)
+		if returncode == 0:
 			if not self.page_opened:
 				basedir = os.path.abspath(self.sample_dir)
 				fp = os.path.join(basedir, 'report.html')
@@ -771,7 +851,7 @@ class StatsparserScheduler(threading.Thread):
 					pass
 				self.page_opened = True
 		else:
-			self.logger.warning("statsparser returned with errorcode {} for directory {}".format(cp.returncode, self.sample_dir))
+			self.logger.warning("statsparser returned with errorcode {} for directory {}".format(returncode,self.sample_dir))
 
 	def join(self, timeout=None):
 		if timeout:
@@ -781,10 +861,97 @@ class StatsparserScheduler(threading.Thread):
 		super(StatsparserScheduler, self).join(timeout)
 
 
+def report_worker(job_q, result_q):
+	'''main function of a report worker process. Creates report pages for the jobs it
+	receives until it receives None.'''
+	# KeyboardInterrupts are handled by the main process, which then stops the workers
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	while True:
+		job = job_q.get()
+		if job is None:
+			break
+		job_id, sample_dir, statsparser_args = job
+		start_time, start_cpu_time = time.time(), time.process_time()
+		try:
+			args = statsparser.parse_args(statsparser.get_argument_parser(), ['-q'] + list(statsparser_args))
+			statsparser.main(args, sample_dir)
+			returncode = 0
+		except SystemExit as e:
+			returncode = e.code if isinstance(e.code, int) else 1
+		except Exception:
+			logging.getLogger(name='gw.rw').exception("failed to create report for directory {}".format(sample_dir))
+			returncode = 1
+		result_q.put( (job_id, returncode, time.time() - start_time, time.process_time() - start_cpu_time) )
+
+
+class ReportWorkerPool():
+	'''manages a set of long-lived processes that create report pages by calling statsparser.main()
+	directly. Interpreter start-up and the import of statsparser and its dependencies only happen
+	once per worker instead of once per report update.'''
+	def __init__(self, num_workers):
+		self.logger = logging.getLogger(name='gw.rwp')
+		# spawn instead of fork, as the main process already runs several threads
+		ctx = mp.get_context('spawn')
+		self.job_q = ctx.Queue()
+		self.result_q = ctx.Queue()
+		self.workers = [ctx.Process(target=report_worker,
+									args=(self.job_q, self.result_q),
+									name='report_worker_{}'.format(i)) for i in range(num_workers)]
+		self.job_ids = itertools.count()
+		self.pending = {}
+		self.pending_lock = threading.Lock()
+		self.collector = threading.Thread(target=self.collect_results)
+		self.collector.daemon = True
+
+	def start(self):
+		for worker in self.workers:
+			worker.start()
+		self.collector.start()
+
+	def collect_results(self):
+		while True:
+			result = self.result_q.get()
+			if result is None:
+				break
+			with self.pending_lock:
+				if result[0] not in self.pending:
+					continue
+				finished, results = self.pending.pop(result[0])
+			results.append(result[1:])
+			finished.set()
+
+	def run_job(self, sample_dir, statsparser_args, stoprequest=None):
+		'''passes a job to the workers and blocks until it is finished. Returns a tuple of
+		returncode, wall time and cpu time, or None if stoprequest was set in the meantime.'''
+		job_id = next(self.job_ids)
+		finished, results = threading.Event(), []
+		with self.pending_lock:
+			self.pending[job_id] = (finished, results)
+		self.job_q.put( (job_id, sample_dir, statsparser_args) )
+		while not finished.wait(timeout=1.):
+			if stoprequest is not None and stoprequest.is_set():
+				with self.pending_lock:
+					self.pending.pop(job_id, None)
+				return None
+		return results[0]
+
+	def stop(self, timeout=60.):
+		for worker in self.workers:
+			self.job_q.put(None)
+		for worker in self.workers:
+			worker.join(timeout)
+			if worker.is_alive():
+				self.logger.warning("terminating {}, which did not finish its last job in time".format(worker.name))
+				worker.terminate()
+		self.result_q.put(None)
+		self.collector.join()
+
+
 class Watcher():
 
 	def __init__(self, minknow_log_basedir, channel, ignore_file_modifications, output_dir, data_basedir, 
-				 statsparser_args, update_interval, watchnchop_args, min_length, min_length_rna, bc_kws):
+				 statsparser_args, update_interval, watchnchop_args, min_length, min_length_rna, bc_kws, report_pool,
+				 transfer_scheduler=None):
 		self.q = queue.PriorityQueue()
 		self.watchnchop_args = watchnchop_args
 		self.min_length = min_length
@@ -795,17 +962,27 @@ class Watcher():
 		self.statsparser_args = statsparser_args
 		self.update_interval = update_interval
 		self.bc_kws = bc_kws
+		self.report_pool = report_pool
+		self.transfer_scheduler = transfer_scheduler
+		self.report_timings = {}
 		self.observed_dir = os.path.join(minknow_log_basedir, "GA{}0000".format(channel+1))
-		self.event_handler = LogFilesEventHandler(self.q, ignore_file_modifications, channel)
+		self.channel_status = ChannelStatus("GA{}0000".format(channel+1), channel)
+		self.spScheduler = None
+		self.wcScheduler = []
+		self.logger = logging.getLogger(name='gw.w{}'.format(channel+1))
+		self.checkpoint_fp = os.path.join(output_dir, 'logs', "GA{}0000_checkpoint.json".format(channel+1))
+		self.log_positions = {}
+		resume_offsets = self.load_checkpoint()
+		self.event_handler = LogFilesEventHandler(self.q, ignore_file_modifications, channel, resume_offsets)
 		self.observer = Observer()
 		self.observer.schedule(self.event_handler, 
 							   self.observed_dir, 
 							   recursive=False)
 		self.observer.start()
-		self.channel_status = ChannelStatus("GA{}0000".format(channel+1), channel)
-		self.spScheduler = None
-		self.wcScheduler = []
-		self.logger = logging.getLogger(name='gw.w{}'.format(channel+1))
+		if self.channel_status.sequencing:
+			self.logger.info("resuming the processing of the running sequencing run")
+			self.start_watchnchop()
+			self.start_statsparser()
 
 		self.logger.info("...watcher for {} ready".format(self.observed_dir))
 
@@ -813,8 +990,9 @@ class Watcher():
 		# checking sheduler queue
 		if not self.q.empty():
 			self.logger.debug("Queue content for {}:".format(self.observed_dir))
+		processed = False
 		while not self.q.empty():
-			timestamp, origin, line = self.q.get()
+			timestamp, origin, line, path, offset = self.q.get()
 			self.logger.debug("received '{}' originating from '{} log' at '{}'".format(line, origin, timestamp))
 
 			if origin == 'server':
@@ -823,112 +1001,158 @@ class Watcher():
 				self.parse_bream_log_line(line)
 			#elif origin == 'analyser':
 			#	self.parse_analyser_log_line(line)
+			if path:
+				self.log_positions[origin] = (path, offset)
+				processed = True
+		if processed:
+			self.save_checkpoint()
+
+	def save_checkpoint(self):
+		'''saves the positions up to which the log files were processed together with the resulting
+		channel status, such that a restarted dominION can resume tailing the log files'''
+		logs = {}
+		for path, offset in self.log_positions.values():
+			try:
+				logs[path] = {'inode': os.stat(path).st_ino, 'offset': offset}
+			except OSError:
+				continue
+		data = {'logs': logs,
+				'flowcell': self.channel_status.flowcell,
+				'run_data': self.channel_status.run_data,
+				'mux_scans': self.channel_status.mux_scans,
+				'sequencing': self.channel_status.sequencing}
+		tmp_fp = self.checkpoint_fp + '.tmp'
+		try:
+			with open(tmp_fp, 'w') as f:
+				print(json.dumps(data, indent=4), file=f)
+			os.replace(tmp_fp, self.checkpoint_fp)
+		except OSError as e:
+			self.logger.warning("checkpoint file {} could not be written: {}".format(self.checkpoint_fp, e))
+
+	def load_checkpoint(self):
+		'''restores the channel status from the checkpoint file and returns the offsets at which the log
+		files are resumed. If any of the log files was replaced or truncated since, nothing is restored
+		and all log files are read from the beginning.'''
+		if not os.path.exists(self.checkpoint_fp):
+			return {}
+		try:
+			with open(self.checkpoint_fp, 'r') as f:
+				data = json.load(f, object_pairs_hook=OrderedDict)
+		except (OSError, ValueError) as e:
+			self.logger.warning("checkpoint file {} could not be read: {}".format(self.checkpoint_fp, e))
+			return {}
+		for path, position in data['logs'].items():
+			try:
+				stat = os.stat(path)
+			except OSError:
+				stat = None
+			if not stat or stat.st_ino != position['inode'] or stat.st_size < position['offset']:
+				self.logger.info("log file {} changed since the last checkpoint, reading all log files from the beginning".format(path))
+				return {}
+		self.channel_status.flowcell = data['flowcell']
+		self.channel_status.run_data = data['run_data']
+		self.channel_status.mux_scans = data['mux_scans']
+		self.channel_status.sequencing = data['sequencing']
+		# live mux scans are removed from the run database on startup
+		if self.channel_status.flowcell.get('asic_id_eeprom') and self.channel_status.mux_scans:
+			RUN_DB.add_mux_scans(self.channel_status.flowcell, self.channel_status.mux_scans)
+		self.logger.info("restored channel status from checkpoint file {}".format(self.checkpoint_fp))
+		return {path:position['offset'] for path, position in data['logs'].items()}
 
 	def parse_server_log_line(self, line):
-		dict_content = {}
-		overwrite = False
-		timestamp = line[:23]
+		SERVER_LOG_EVENTS.dispatch(self, line, line[:23])
 
+	def parse_bream_log_line(self, line):
+		BREAM_LOG_EVENTS.dispatch(self, line, line.split(" - ")[1])
+
+	def on_protocol_started(self, line, timestamp):
 		# fetch output_path, run_id, script_path, relative_path, protocol_start, flowcell_id [, experiment, sample]
-		if   	"protocol_started"										in line:
-			for m in re.finditer('([^\s,]+) = ([^\s,]+)', line):
-				dict_content[m.group(1)] = m.group(2)
-			overwrite = True
-			dict_content['relative_path'] = dict_content['output_path'].split("/./")[1].strip("/")
-			subdirs = dict_content['relative_path'].split('/')
-			if len(subdirs) == 3:
-				# case sequencing protocol
-				dict_content['experiment'] = subdirs[0]
-				dict_content['sample'] = subdirs[1]
-				dict_content['flowcell_id'] = subdirs[2].split('_')[3]
-			elif len(subdirs) == 1:
-				# case qc protocol
-				dict_content['flowcell_id'] = subdirs[0].split('_')[3]
-			self.logger.info("PROTOCOL START")
-			set_update_overview()
-			self.channel_status.run_data['protocol_start'] = timestamp
+		dict_content = dict(KEY_VALUE_PATTERN.findall(line))
+		dict_content['relative_path'] = dict_content['output_path'].split("/./")[1].strip("/")
+		subdirs = dict_content['relative_path'].split('/')
+		if len(subdirs) == 3:
+			# case sequencing protocol
+			dict_content['experiment'] = subdirs[0]
+			dict_content['sample'] = subdirs[1]
+			dict_content['flowcell_id'] = subdirs[2].split('_')[3]
+		elif len(subdirs) == 1:
+			# case qc protocol
+			dict_content['flowcell_id'] = subdirs[0].split('_')[3]
+		self.logger.info("PROTOCOL START")
+		set_update_overview()
+		self.channel_status.run_data['protocol_start'] = timestamp
+		self.channel_status.update(dict_content, True)
 
-		# fetch protocol_end
-		elif	"protocol_finished" 									in line:
-			self.logger.info("PROTOCOL END")
-			set_update_overview()
-			self.channel_status.run_data['protocol_end'] = timestamp
-			if self.channel_status.mux_scans:
-				self.save_logdata()
-			self.channel_status.reset_channel()
-			self.stop_statsparser()
-			self.stop_watchnchop()
+	def on_protocol_finished(self, line, timestamp):
+		self.logger.info("PROTOCOL END")
+		set_update_overview()
+		self.channel_status.run_data['protocol_end'] = timestamp
+		if self.channel_status.mux_scans:
+			self.save_logdata()
+		self.channel_status.reset_channel()
+		self.stop_statsparser()
+		self.stop_watchnchop()
 
-		# 
-		elif	"[engine/info]: : flowcell_discovered" 					in line:
-			for m in re.finditer('([^\s,]+) = ([^\s,]+)', line):
-				dict_content[m.group(1)] = m.group(2)
-			overwrite = True
-			self.logger.info("FLOWCELL DISCOVERED")
-			set_update_overview()
-			self.channel_status.flowcell_disconnected()
-			self.stop_statsparser()
-			self.stop_watchnchop()
+	def on_flowcell_discovered(self, line, timestamp):
+		dict_content = dict(KEY_VALUE_PATTERN.findall(line))
+		self.logger.info("FLOWCELL DISCOVERED")
+		set_update_overview()
+		self.channel_status.flowcell_disconnected()
+		self.stop_statsparser()
+		self.stop_watchnchop()
+		if dict_content:
+			self.channel_status.update(dict_content, True)
 
-		elif   	"[engine/info]: : data_acquisition_started"				in line:
-			for m in re.finditer('([^\s,]+) = ([^\s,]+)', line):
-				dict_content[m.group(1)] = m.group(2)
-			overwrite = True
+	def on_data_acquisition_started(self, line, timestamp):
+		dict_content = dict(KEY_VALUE_PATTERN.findall(line))
+		if dict_content:
+			self.channel_status.update(dict_content, True)
 
-		elif	"flowcell_disconnected"									in line:
-			self.logger.info("FLOWCELL DISCONNECTED")
-			set_update_overview()
-			self.channel_status.flowcell_disconnected()
-
-		elif 	"pores available for sequencing" 						in line:
-			active_pores = None
-			in_use = None
-			for m in re.finditer("has ([0-9]+) pores available for sequencing", line):
-				active_pores = m.group(1)
-			for m in re.finditer("Starting sequencing with ([0-9]+) pores", line):
-				in_use = m.group(1)
-			self.logger.info("new mux scan result: {} active, {} in use".format(active_pores, in_use))
-			self.channel_status.add_mux_scan(timestamp, active_pores, in_use=in_use)
-			set_update_overview()
-			self.save_logdata()
+	def on_flowcell_disconnected(self, line, timestamp):
+		self.logger.info("FLOWCELL DISCONNECTED")
+		set_update_overview()
+		self.channel_status.flowcell_disconnected()
+
+	def on_mux_scan_result(self, line, timestamp):
+		active_pores = None
+		in_use = None
+		for m in ACTIVE_PORES_PATTERN.finditer(line):
+			active_pores = m.group(1)
+		for m in PORES_IN_USE_PATTERN.finditer(line):
+			in_use = m.group(1)
+		self.logger.info("new mux scan result: {} active, {} in use".format(active_pores, in_use))
+		self.channel_status.add_mux_scan(timestamp, active_pores, in_use=in_use)
+		set_update_overview()
+		self.save_logdata()
 
+	def on_attribute(self, line, timestamp):
+		dict_content = dict(ATTRIBUTE_PATTERN.findall(line))
 		if dict_content:
-			self.channel_status.update(dict_content, overwrite)
-
-	def parse_bream_log_line(self, line):
-		dict_content = {}
-		overwrite = False
-		timestamp = line.split(" - ")[1]
-
-		if 		"INFO - Attribute"								in line:
-			for m in re.finditer("([^\s,]+) set to (.+)", line): 
-				dict_content[m.group(1)] = m.group(2)
-
-		elif 	"INFO - Asked to start protocol"				in line:
-			for m in re.finditer("'--([^\s,]+)=([^\s,]+)'", line):
-				dict_content[m.group(1)] = m.group(2)
-				overwrite = True
-
-		elif 	"INFO - Updating context tags in MinKNOW with" 	in line:
-			for m in re.finditer("'([^\s,]+)'[:,] u?'([^\s,]+)'", line):
-				dict_content[m.group(1)] = m.group(2)
-			if 'sequencing_kit' in dict_content:
-				dict_content['sequencing_kit'] = dict_content['sequencing_kit'].upper()
-
-		elif	"platform_qc.report"			in line:
-			self.logger.info("QC FINISHED")
-
-		elif	"sequencing.start"										in line:
-			dict_content["sequencing_start_time"] = timestamp
-			self.logger.info("SEQUENCING STARTS")
-			self.channel_status.sequencing = True
-			set_update_overview()
+			self.channel_status.update(dict_content, False)
 
-			self.start_watchnchop()
-			self.start_statsparser()
+	def on_start_protocol(self, line, timestamp):
+		dict_content = dict(PROTOCOL_ARGUMENT_PATTERN.findall(line))
+		if dict_content:
+			self.channel_status.update(dict_content, True)
 
+	def on_context_tags(self, line, timestamp):
+		dict_content = dict(CONTEXT_TAG_PATTERN.findall(line))
+		if 'sequencing_kit' in dict_content:
+			dict_content['sequencing_kit'] = dict_content['sequencing_kit'].upper()
 		if dict_content:
-			self.channel_status.update(dict_content, overwrite)
+			self.channel_status.update(dict_content, False)
+
+	def on_qc_report(self, line, timestamp):
+		self.logger.info("QC FINISHED")
+
+	def on_sequencing_start(self, line, timestamp):
+		self.logger.info("SEQUENCING STARTS")
+		self.channel_status.sequencing = True
+		set_update_overview()
+
+		self.start_watchnchop()
+		self.start_statsparser()
+		self.channel_status.update({"sequencing_start_time" : timestamp}, False)
 
 	def check_attributes(self, attributes):
 		for key in attributes:
@@ -979,20 +1203,7 @@ class Watcher():
 			os.makedirs(target_dir)
 		with open( os.path.join(target_dir, fn), 'w') as f:
 			print(json.dumps(data, indent=4), file=f)
-
-		ALL_RUNS_LOCK.acquire()
-		run_id = self.channel_status.run_data['run_id']
-		asic_id_eeprom = self.channel_status.flowcell['asic_id_eeprom']
-		if asic_id_eeprom in ALL_RUNS:
-			ALL_RUNS[asic_id_eeprom][run_id] = {'flowcell': data[0],
-												'run_data': data[1],
-												'mux_scans': data[2]}
-		else:
-			ALL_RUNS[asic_id_eeprom] = {}
-			ALL_RUNS[asic_id_eeprom][run_id] = {'flowcell': data[0],
-												'run_data': data[1],
-												'mux_scans': data[2]}
-		ALL_RUNS_LOCK.release()
+		RUN_DB.update_file(os.path.join(target_dir, fn))
 
 	def start_watchnchop(self):
 		missing_key = self.check_attributes(['experiment', 'sample', 'sequencing_kit', 'run_id', 'fastq_reads_per_file', 'relative_path'])
@@ -1002,11 +1213,12 @@ class Watcher():
 
 		self.stop_watchnchop()
 
-		stats_fp = os.path.join(self.output_dir,
-								'runs',
-								self.channel_status.run_data['experiment'],
-								self.channel_status.run_data['sample'],
-								"{}_stats.csv".format(self.channel_status.run_data['run_id']))
+		sample_dir = os.path.join(self.output_dir,
+								  'runs',
+								  self.channel_status.run_data['experiment'],
+								  self.channel_status.run_data['sample'])
+		stats_fp = os.path.join(sample_dir, "{}_stats.csv".format(self.channel_status.run_data['run_id']))
+		manifest_fp = os.path.join(sample_dir, self.channel_status.run_data['run_id'] + MANIFEST_SUFFIX)
 		self.wcScheduler.append(WatchnchopScheduler(self.data_basedir,
 													self.channel_status.run_data['relative_path'],
 													self.channel_status.run_data['experiment'],
@@ -1017,7 +1229,9 @@ class Watcher():
 													self.channel,
 													self.watchnchop_args,
 													self.min_length,
-													self.min_length_rna))
+													self.min_length_rna,
+													self.transfer_scheduler,
+													manifest_fp))
 		self.wcScheduler[-1].start()
 		return
 
@@ -1044,7 +1258,9 @@ class Watcher():
 		self.spScheduler = StatsparserScheduler(self.update_interval, 
 												sample_dir, 
 												self.statsparser_args, 
-												self.channel)
+												self.channel,
+												self.report_pool,
+												self.report_updated)
 		self.spScheduler.start()
 
 	def stop_statsparser(self, timeout=1.2):
@@ -1054,6 +1270,30 @@ class Watcher():
 			else:
 				self.spScheduler.join()
 
+	def report_updated(self, sample_dir, returncode, wall_time, cpu_time):
+		'''called by the statsparser scheduler each time a report worker finished a job'''
+		self.report_timings[sample_dir] = {'returncode'	:	returncode,
+										   'wall_time'	:	wall_time,
+										   'cpu_time'	:	cpu_time,
+										   'finished'	:	datetime.now()}
+		self.logger.info("report for {} updated in {:.1f} s ({:.1f} s cpu time)".format(sample_dir, wall_time, cpu_time))
+
+# events of the MinKNOW log files that are acted on, in order of priority: if a line contains key words
+# of several events, only the handler of the event registered first is called
+SERVER_LOG_EVENTS = EventDispatcher([
+	('protocol_started',			'protocol_started',							Watcher.on_protocol_started),
+	('protocol_finished',			'protocol_finished',						Watcher.on_protocol_finished),
+	('flowcell_discovered',			'[engine/info]: : flowcell_discovered',		Watcher.on_flowcell_discovered),
+	('data_acquisition_started',	'[engine/info]: : data_acquisition_started',Watcher.on_data_acquisition_started),
+	('flowcell_disconnected',		'flowcell_disconnected',					Watcher.on_flowcell_disconnected),
+	('mux_scan_result',				'pores available for sequencing',			Watcher.on_mux_scan_result)])
+BREAM_LOG_EVENTS = EventDispatcher([
+	('attribute',					'INFO - Attribute',							Watcher.on_attribute),
+	('start_protocol',				'INFO - Asked to start protocol',			Watcher.on_start_protocol),
+	('context_tags',				'INFO - Updating context tags in MinKNOW with',Watcher.on_context_tags),
+	('qc_report',					'platform_qc.report',						Watcher.on_qc_report),
+	('sequencing_start',			'sequencing.start',							Watcher.on_sequencing_start)])
+
 class OpenedFilesHandler():
 	'''manages a set of opened files, reads their contents and 
 	processes them line by line. Incomplete lines are stored until
@@ -1062,9 +1302,13 @@ class OpenedFilesHandler():
 		self.logger = logging.getLogger(name='gw.w{}.ofh'.format(channel+1))
 		self.open_files = {}
 
-	def open_new_file(self, path):
+	def open_new_file(self, path, offset=0):
 		self.logger.info("Opening file {}".format(path))
-		self.open_files[path] = [open(path, 'r'), ""]
+		file = open(path, 'rb')
+		if offset:
+			self.logger.info("Resuming file {} at byte {}".format(path, offset))
+			file.seek(offset)
+		self.open_files[path] = [file, b"", offset]
 
 	def close_file(self, path):
 		self.logger.debug("Attempting to close file {}".format(path))
@@ -1077,29 +1321,36 @@ class OpenedFilesHandler():
 			self.logger.debug("Deleted entry in open_files for file {}".format(path))
 
 	def process_lines_until_EOF(self, process_function, path):
-		file = self.open_files[path][0]
+		'''passes each complete line to process_function together with the path and the offset of
+		the end of the line'''
+		entry = self.open_files[path]
+		file = entry[0]
 		while 1:
 			line = file.readline()
-			if line == "":
+			if line == b"":
 				break
-			elif line.endswith("\n"):
-				line = (self.open_files[path][1] + line).strip()
+			elif line.endswith(b"\n"):
+				entry[2] += len(entry[1]) + len(line)
+				line = (entry[1] + line).decode('utf-8', 'replace').strip()
 				if line:
-					process_function(line)
-				self.open_files[path][1] = ""
+					process_function(line, path, entry[2])
+				entry[1] = b""
 			else:
 				#line potentially incomplete
-				self.open_files[path][1] = self.open_files[path][1] + line
+				entry[1] = entry[1] + line
 
 
 class LogFilesEventHandler(FileSystemEventHandler):
 	control_server_log, bream_log = None, None
 
-	def __init__(self, q, ignore_file_modifications, channel):
+	def __init__(self, q, ignore_file_modifications, channel, resume_offsets={}):
 		super(LogFilesEventHandler, self).__init__()
 		self.ignore_file_modifications = ignore_file_modifications
+		# byte offsets at which log files that were processed before a restart are resumed
+		self.resume_offsets = dict(resume_offsets)
 		self.file_handler = OpenedFilesHandler(channel)
 		self.comm_q = q
+		self.channel = channel
 
 		# while no server log file is opened, all lines read are buffered in a seperate Priority Queue
 		self.buff_q = queue.PriorityQueue()
@@ -1134,11 +1385,12 @@ class LogFilesEventHandler(FileSystemEventHandler):
 			else:
 				self.logger.debug("File {} is not of concern for this tool".format(event.src_path))
 				return
-			self.file_handler.open_new_file(event.src_path)
+			self.file_handler.open_new_file(event.src_path, self.resume_offsets.pop(event.src_path, 0))
 			self.file_handler.process_lines_until_EOF(process_function, event.src_path)
 			self.logger.info("approx. queue size: {}".format(self.q.qsize()))
 			if activate_q:
 				self.activate_q()
+			self.notify()
 
 	def on_deleted(self, event):
 		if not event.is_directory:
@@ -1165,6 +1417,7 @@ class LogFilesEventHandler(FileSystemEventHandler):
 				else:
 					self.logger.warning("case not handled")
 					return
+				self.notify()
 			else:
 				if not self.ignore_file_modifications:
 					self.on_created(event)
@@ -1177,76 +1430,100 @@ class LogFilesEventHandler(FileSystemEventHandler):
 		while not self.buff_q.empty():
 			self.q.put(self.buff_q.get())
 
-	def enqueue_server_log_line(self, line):
+	def notify(self):
+		'''wakes up the main loop to process the lines in the communication queue'''
+		if self.q is self.comm_q and not self.q.empty():
+			EVENTS.put( ('log', self.channel) )
+
+	def enqueue_server_log_line(self, line, path=None, offset=None):
+		# drop lines without key words before parsing their timestamp
+		if not SERVER_LOG_EVENTS.search(line):
+			return
 		try:
-			self.q.put( (dateutil.parser.parse(line[:23]), 'server', line) )
+			self.q.put( (parse_timestamp(line[:23]), 'server', line, path, offset) )
 		except:
 			self.logger.debug("the timestamp of the following line in the server log file could not be parsed:\n{}".format(line))
 
-	def enqueue_bream_log_line(self, line):
+	def enqueue_bream_log_line(self, line, path=None, offset=None):
+		if not BREAM_LOG_EVENTS.search(line):
+			return
 		try:
-			self.q.put( (dateutil.parser.parse(line.split(' - ')[1]), 'bream', line) )
+			self.q.put( (parse_timestamp(line.split(' - ')[1]), 'bream', line, path, offset) )
 		except:
 			self.logger.debug("the timestamp of the following line in the bream log file could not be parsed:\n{}".format(line))
 
 
 class RunsDirsEventHandler(FileSystemEventHandler):
+	'''keeps the run database in line with the runs directory. Changed experiment and sample
+	directories and logdata files are collected for a short delay, such that bursts of events, e.g.
+	from renaming a directory, result in a single update of only the affected entries.'''
 
-	def __init__(self, observed_dir):
+	def __init__(self, observed_dir, delay=1.):
 		super(RunsDirsEventHandler, self).__init__()
 		self.observed_dir = os.path.abspath(observed_dir)
+		self.delay = delay
+		self.pending = set()
+		self.pending_lock = threading.Lock()
+		self.timer = None
 		self.logger = logging.getLogger(name='gw.reh')
 
 	def on_moved(self, event):
-		if event.is_directory or (self.depth(event.src_path) == 3 and event.src_path.endswith('.json')):
-			self.logger.debug("moved {}, depth {}, \ndest {}".format(event.src_path, self.depth(event.src_path), event.dest_path))
-			if self.observed_dir in event.dest_path and self.depth(event.dest_path) == self.depth(event.src_path):
-				self.reload_runs()
-			else:
-				self.on_deleted(event)
+		self.logger.debug("moved {}, depth {}, \ndest {}".format(event.src_path, self.depth(event.src_path), event.dest_path))
+		self.schedule_update(event.is_directory, event.src_path, event.dest_path)
 
 	def on_created(self, event):
-		if event.is_directory:
-			self.logger.debug("created directory {}, depth {}".format(event.src_path, self.depth(event.src_path)))
-			if 1 <= self.depth(event.src_path) <= 2:
-				self.reload_runs()
-		elif self.depth(event.src_path) == 3 and event.src_path.endswith('.json'):
-			self.logger.debug("created file {}, depth {}".format(event.src_path, self.depth(event.src_path)))
-			self.reload_runs()
+		self.logger.debug("created {}, depth {}".format(event.src_path, self.depth(event.src_path)))
+		self.schedule_update(event.is_directory, event.src_path)
 
 	def on_modified(self, event):
-		if event.is_directory:
-			self.logger.debug("modified directory {}, depth {}".format(event.src_path, self.depth(event.src_path)))
+		if not event.is_directory:
+			self.schedule_update(False, event.src_path)
 
 	def on_deleted(self, event):
-		if event.is_directory:
-			self.logger.debug("deleted directory {}, depth {}".format(event.src_path, self.depth(event.src_path)))
-			if 1 <= self.depth(event.src_path) <= 2:
-				self.reload_runs()
-		elif self.depth(event.src_path) == 3 and event.src_path.endswith('.json'):
-			self.logger.debug("deleted file {}, depth {}".format(event.src_path, self.depth(event.src_path)))
-			self.reload_runs()
+		self.logger.debug("deleted {}, depth {}".format(event.src_path, self.depth(event.src_path)))
+		self.schedule_update(event.is_directory, event.src_path)
 
 	def depth(self, src_path):
 		src_path = os.path.abspath(src_path)
 		return len(src_path.replace(self.observed_dir, '').strip('/').split('/'))
 
-	def reload_runs(self):
-		ALL_RUNS_LOCK.acquire()
-		self.logger.info('deleting and re-importing all runs due to changes in the run directory')
-		# delete sequencing runs
-		to_delete = []
-		for asic_id_eeprom in ALL_RUNS:
-			for run_id in ALL_RUNS[asic_id_eeprom]:
-				if 'qc' not in ALL_RUNS[asic_id_eeprom][run_id]['run_data']['experiment_type']:
-					to_delete.append( (asic_id_eeprom, run_id) )
-		for asic_id_eeprom, run_id in to_delete:
-			del ALL_RUNS[asic_id_eeprom][run_id]
-		#reload runs
-		import_runs(self.observed_dir)
-		ALL_RUNS_LOCK.release()
-		set_update_overview()
-		return
+	def is_relevant(self, is_directory, path):
+		'''experiment and sample directories and the logdata files within sample directories'''
+		if not os.path.abspath(path).startswith(self.observed_dir + os.sep):
+			return False
+		if is_directory:
+			return 1 <= self.depth(path) <= 2
+		return self.depth(path) == 3 and path.endswith(LOGDATA_SUFFIX)
+
+	def schedule_update(self, is_directory, *paths):
+		paths = [os.path.abspath(path) for path in paths if self.is_relevant(is_directory, path)]
+		if not paths:
+			return
+		with self.pending_lock:
+			self.pending.update(paths)
+			if not self.timer:
+				self.timer = threading.Timer(self.delay, self.update_runs)
+				self.timer.daemon = True
+				self.timer.start()
+
+	def update_runs(self):
+		with self.pending_lock:
+			paths, self.pending, self.timer = self.pending, set(), None
+		# paths within a pending directory are covered by the update of the directory
+		covered = []
+		for path in sorted(paths):
+			if not any(path.startswith(directory + os.sep) for directory in covered):
+				covered.append(path)
+		self.logger.info('updating run database for {} changed paths in the run directory'.format(len(covered)))
+		changed = False
+		# removals first, such that runs of a renamed directory do not conflict with their old entries
+		for path in sorted(covered, key=os.path.exists):
+			if path.endswith(LOGDATA_SUFFIX):
+				changed |= RUN_DB.update_file(path)
+			else:
+				changed |= RUN_DB.sync(path)
+		if changed:
+			set_update_overview()
 
 def standalone():
 	args = parse_args()
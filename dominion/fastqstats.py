@@ -0,0 +1,279 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import re
+import gzip
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .version import __version__
+from .helper import initLogger, ArgHelpFormatter
+
+# number of bytes of a fastq file that are processed at once
+CHUNK_SIZE = 8 * 1024**2
+# compression level used by IO::Compress::Gzip in previous versions of watchnchop
+GZIP_LEVEL = 6
+# number of uncompressed bytes that are compressed into one gzip member
+GZIP_BLOCK_SIZE = 4 * 1024**2
+HEADER_PATTERN = re.compile(rb'(.+) runid=.+ read=(\d+) ch=(\d+) start_time=(\S+)')
+GC_BYTES = np.zeros(256, dtype=np.uint8)
+GC_BYTES[list(b'cCgG')] = 1
+logger = None
+
+def get_argument_parser():
+	argument_parser = argparse.ArgumentParser(description='''Calculates length, mean quality and G+C content of the reads in
+														  porechop output files, appends them to a stats file and writes
+														  the reads passing the length and quality filters to gzipped
+														  fastq files in the output directory.''',
+											  formatter_class=ArgHelpFormatter,
+											  add_help=False)
+
+	main_options = argument_parser.add_argument_group('Main options')
+	main_options.add_argument('fastq',
+							  nargs='+',
+							  help='''porechop output files, the barcode of all reads of a file is taken from its name
+							  	   (<barcode>.fastq)''')
+	main_options.add_argument('-s', '--stats',
+							  required=True,
+							  help='stats file the read statistics are appended to')
+	main_options.add_argument('-f', '--fast5split',
+							  help='''file to which read ids and barcodes of reads are appended, which is used for
+							  	   splitting fast5 files into barcode bins''')
+	main_options.add_argument('-o', '--outdir',
+							  required=True,
+							  help='directory containing the gzipped fastq files of reads that passed the filters')
+	main_options.add_argument('-l', '--min_length',
+							  type=int,
+							  default=1000,
+							  help='minimal length to pass filter')
+	main_options.add_argument('-q', '--min_quality',
+							  type=int,
+							  default=5,
+							  help='minimal quality to pass filter')
+	main_options.add_argument('-a', '--all_fast5',
+							  action='store_true',
+							  help='also write reads removed by length and quality filtering to the fast5split file')
+	main_options.add_argument('-z', '--compression_level',
+							  type=int,
+							  choices=range(1,10),
+							  metavar='[1-9]',
+							  default=GZIP_LEVEL,
+							  help='gzip compression level of the written fastq files')
+	main_options.add_argument('-t', '--threads',
+							  type=int,
+							  default=1,
+							  help='number of threads compressing blocks of the written fastq files in parallel')
+
+	help_group = argument_parser.add_argument_group('Help')
+	help_group.add_argument('-h', '--help',
+							action='help',
+							default=argparse.SUPPRESS,
+							help='Show this help message and exit')
+	help_group.add_argument('--version',
+							action='version',
+							version=__version__,
+							help="Show program's version number and exit")
+	help_group.add_argument('-v', '--verbose',
+							action='store_true',
+							help='Additional status information is printed to stdout')
+	help_group.add_argument('--quiet',
+							action='store_true',
+							help='No prints to stdout')
+	return argument_parser
+
+def parse_args(argument_parser, ext_args=None):
+	args = argument_parser.parse_args(ext_args)
+
+	global logger
+	if args.verbose:
+		loglvl = logging.DEBUG
+	elif args.quiet:
+		loglvl = logging.WARNING
+	else:
+		loglvl = logging.INFO
+	initLogger(level=loglvl)
+	logger = logging.getLogger(name='fs')
+	return args
+
+class GzipBlockWriter():
+	'''Appends data to a gzip file as a series of gzip members of up to GZIP_BLOCK_SIZE 
+	uncompressed bytes each. The blocks are compressed in parallel by the threads of pool and 
+	written in order. Standard gzip readers decompress the concatenated members as one file.'''
+	def __init__(self, fp, pool, threads, level=GZIP_LEVEL, block_size=GZIP_BLOCK_SIZE):
+		self.f = open(fp, 'ab')
+		self.pool = pool
+		self.level = level
+		self.block_size = block_size
+		self.buffer = []
+		self.buffered = 0
+		self.pending = deque()
+		# limits the memory occupied by blocks waiting for compression
+		self.max_pending = 2 * threads
+
+	def write(self, data):
+		self.buffer.append(data)
+		self.buffered += len(data)
+		if self.buffered >= self.block_size:
+			data = b''.join(self.buffer)
+			for start in range(0, len(data) - self.block_size + 1, self.block_size):
+				self.submit(data[start:start+self.block_size])
+			rest = len(data) % self.block_size
+			self.buffer = [data[len(data)-rest:]] if rest else []
+			self.buffered = rest
+
+	def submit(self, block):
+		self.pending.append(self.pool.submit(gzip.compress, block, self.level))
+		while len(self.pending) > self.max_pending:
+			self.f.write(self.pending.popleft().result())
+
+	def close(self):
+		if self.buffered:
+			self.submit(b''.join(self.buffer))
+		while self.pending:
+			self.f.write(self.pending.popleft().result())
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def read_chunks(fp, chunk_size=CHUNK_SIZE):
+	'''Yields the contents of a fastq file in chunks of complete 4-line records.'''
+	remainder = b''
+	with open(fp, 'rb') as f:
+		while True:
+			data = f.read(chunk_size)
+			if not data:
+				break
+			chunk = remainder + data
+			newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n'))
+			complete = (newlines.size // 4) * 4
+			if not complete:
+				remainder = chunk
+				continue
+			end = newlines[complete-1] + 1
+			yield chunk[:end]
+			remainder = chunk[end:]
+	if remainder.strip():
+		# last record without final newline
+		yield remainder + b'\n'
+
+def line_bounds(chunk):
+	'''Returns start and end of each line in chunk, excluding line breaks.'''
+	buf = np.frombuffer(chunk, dtype=np.uint8)
+	ends = np.flatnonzero(buf == ord('\n'))
+	starts = np.concatenate([[0], ends[:-1] + 1])
+	# remove carriage returns preceding the newline
+	cr = (ends > starts) & (buf[np.maximum(ends-1, 0)] == ord('\r'))
+	ends = ends - cr
+	return starts, ends
+
+def format_2f(values):
+	'''Formats values like sprintf('%2.2f') in perl. Divisions by zero are formatted as 0.00.'''
+	return ['{:.2f}'.format(v) if v == v else '0.00' for v in values.tolist()]
+
+def line_sums(values, starts, ends):
+	'''Returns the sum of values over each line given by starts and ends. Only the values within the
+	lines are summed up, with np.add.reduceat instead of a cumulative sum over the whole chunk.'''
+	if not starts.size:
+		return np.zeros(0, dtype=np.int64)
+	bounds = np.empty(2 * starts.size, dtype=np.int64)
+	bounds[0::2], bounds[1::2] = starts, ends
+	sums = np.add.reduceat(values, bounds, dtype=np.int64)[0::2]
+	# reduceat returns the value at the start index for empty lines
+	sums[ends <= starts] = 0
+	return sums
+
+def chunk_stats(chunk):
+	'''Calculates the statistics of all reads in a chunk of complete fastq records with vectorized
+	operations over the chunk buffer. Returns the lines of each record and the statistics.'''
+	buf = np.frombuffer(chunk, dtype=np.uint8)
+	starts, ends = line_bounds(chunk)
+	n = starts.size // 4
+	seq_starts, seq_ends = starts[1:4*n:4], ends[1:4*n:4]
+	qual_starts, qual_ends = starts[3:4*n:4], ends[3:4*n:4]
+
+	lengths = seq_ends - seq_starts
+	qual_lengths = qual_ends - qual_starts
+	gc_counts = line_sums(GC_BYTES[buf], seq_starts, seq_ends)
+	qual_sums = line_sums(buf, qual_starts, qual_ends) - 33 * qual_lengths
+	with np.errstate(divide='ignore', invalid='ignore'):
+		gc = gc_counts / lengths * 100
+		qual = qual_sums / qual_lengths
+	return starts, ends, lengths, format_2f(gc), format_2f(qual)
+
+def process_file(fp, barcode, stats_f, fast5split_f, gz_f, min_length, min_quality, all_fast5):
+	'''Appends the statistics of all reads in porechop output file fp to stats_f and writes
+	passed reads to gz_f. Returns the number of processed and passed reads.'''
+	reads, passed = 0, 0
+	barcode_b = barcode.encode()
+	for chunk in read_chunks(fp):
+		starts, ends, lengths, gcs, quals = chunk_stats(chunk)
+		# perl compared the rounded mean quality with the minimal quality
+		passed_qual = np.array(quals, dtype=float) >= min_quality
+		passed_length = lengths >= min_length
+		stats_lines, fast5split_lines, fastq_records = [], [], []
+		for i in range(lengths.size):
+			header_line = chunk[starts[4*i]:ends[4*i]]
+			header = header_line[header_line.find(b'@')+1:]
+			m = HEADER_PATTERN.match(header)
+			read_id, read, pore, start_time = m.groups() if m else (b'', b'', b'', b'')
+			if passed_qual[i]:
+				if passed_length[i]:
+					subset = b'Passed'
+					fast5split_lines.append(read_id + b'\t' + barcode_b + b'\n')
+					fastq_records.append(b'@' + header + b'\n' + chunk[starts[4*i+1]:ends[4*i+1]] + b'\n+\n' +
+										 chunk[starts[4*i+3]:ends[4*i+3]] + b'\n')
+				else:
+					subset = 'length<{}'.format(min_length).encode()
+			else:
+				subset = 'qual<{}'.format(min_quality).encode()
+			if all_fast5 and subset != b'Passed':
+				fast5split_lines.append(read_id + b'\t' + barcode_b + b'\n')
+			stats_lines.append(b'\t'.join([read_id, str(lengths[i]).encode(), quals[i].encode(), gcs[i].encode(),
+										   subset, read, pore, start_time, barcode_b]) + b'\n')
+		stats_f.write(b''.join(stats_lines))
+		if fast5split_f:
+			fast5split_f.write(b''.join(fast5split_lines))
+		gz_f.write(b''.join(fastq_records))
+		reads += lengths.size
+		passed += len(fastq_records)
+	return reads, passed
+
+def main(args):
+	fast5split_f = open(args.fast5split, 'ab') if args.fast5split else None
+	threads = max(args.threads, 1)
+	with open(args.stats, 'ab') as stats_f, ThreadPoolExecutor(threads) as pool:
+		for fp in args.fastq:
+			barcode = os.path.basename(fp)
+			if barcode.endswith('.fastq'):
+				barcode = barcode[:-len('.fastq')]
+			with GzipBlockWriter(os.path.join(args.outdir, barcode + '.fastq.gz'), pool, threads,
+								 args.compression_level) as gz_f:
+				reads, passed = process_file(fp, barcode, stats_f, fast5split_f, gz_f,
+											 args.min_length, args.min_quality, args.all_fast5)
+			logger.info("processed {} reads of {}, {} passed the filters".format(reads, fp, passed))
+	if fast5split_f:
+		fast5split_f.close()
+
+def standalone():
+	args = parse_args(get_argument_parser())
+	main(args)
+
+if __name__ == '__main__':
+	standalone()
@@ -0,0 +1,70 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+from collections import Counter
+from datetime import datetime
+import dateutil.parser
+
+# precompiled extractors for the payloads of MinKNOW log lines, see the handlers of Watcher
+KEY_VALUE_PATTERN = re.compile(r'([^\s,]+) = ([^\s,]+)')
+ACTIVE_PORES_PATTERN = re.compile(r'has ([0-9]+) pores available for sequencing')
+PORES_IN_USE_PATTERN = re.compile(r'Starting sequencing with ([0-9]+) pores')
+ATTRIBUTE_PATTERN = re.compile(r'([^\s,]+) set to (.+)')
+PROTOCOL_ARGUMENT_PATTERN = re.compile(r"'--([^\s,]+)=([^\s,]+)'")
+CONTEXT_TAG_PATTERN = re.compile(r"'([^\s,]+)'[:,] u?'([^\s,]+)'")
+# timestamps written by MinKNOW, e.g. 2018-06-12 10:14:08.123
+TIMESTAMP_PATTERN = re.compile(r'\s*(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)(?:[.,](\d{1,6}))?\s*$')
+
+def parse_timestamp(timestamp):
+	'''Parses timestamps of the form YYYY-MM-DD hh:mm:ss[.ffffff] with fixed positions of all fields.
+	Other formats are parsed with dateutil.'''
+	m = TIMESTAMP_PATTERN.match(timestamp)
+	if not m:
+		return dateutil.parser.parse(timestamp)
+	year, month, day, hour, minute, second, fraction = m.groups()
+	microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+	return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond)
+
+class EventDispatcher():
+	'''Dispatches log lines to the handler of the first registered event whose key word is contained
+	in the line. All key words are searched in a single pass over the line.'''
+
+	def __init__(self, events=()):
+		self.events = []
+		self.counts = Counter()
+		for name, keyword, handler in events:
+			self.register(name, keyword, handler)
+
+	def register(self, name, keyword, handler):
+		'''Appends an event with the lowest priority. handler is called with the object passed to
+		dispatch(), the line and any further arguments.'''
+		self.events.append( (name, keyword, handler) )
+		keywords = [re.escape(kw) for _, kw, _ in self.events]
+		self.filter = re.compile('|'.join(keywords))
+		# key words are matched within a lookahead to also find key words overlapping each other
+		self.pattern = re.compile('(?=' + '|'.join('({})'.format(kw) for kw in keywords) + ')')
+
+	def search(self, line):
+		return self.filter.search(line) is not None
+
+	def dispatch(self, obj, line, *args):
+		'''Calls the handler of the matching event registered first, counts the event and returns its
+		name. Returns None if no key word is contained in line.'''
+		if not self.filter.search(line):
+			return None
+		index = min(m.lastindex for m in self.pattern.finditer(line)) - 1
+		name, _, handler = self.events[index]
+		self.counts[name] += 1
+		handler(obj, line, *args)
+		return name
@@ -0,0 +1,97 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from time import gmtime, strftime
+import numpy as np
+import pandas as pd
+from .version import __version__
+
+MANIFEST_NAME = '.plot_manifest.json'
+# number of refreshes for which hit and miss counts are kept in the manifest
+MAX_REFRESHES = 100
+logger = logging.getLogger(name='sp.pc')
+
+def update_hash(h, obj):
+	'''Feeds a type-tagged representation of obj into hash object h.'''
+	if isinstance(obj, np.ndarray):
+		h.update('nd{}{}'.format(obj.dtype.str, obj.shape).encode())
+		h.update(np.ascontiguousarray(obj).tobytes())
+	elif isinstance(obj, (pd.DataFrame, pd.Series)):
+		h.update('pd{}{}'.format(list(obj.index), list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name).encode())
+		h.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+	elif isinstance(obj, (list, tuple)):
+		h.update('l{}'.format(len(obj)).encode())
+		for item in obj:
+			update_hash(h, item)
+	elif isinstance(obj, dict):
+		h.update('d{}'.format(len(obj)).encode())
+		for key in sorted(obj, key=str):
+			update_hash(h, key)
+			update_hash(h, obj[key])
+	elif callable(obj):
+		h.update('f{}.{}'.format(obj.__module__, obj.__qualname__).encode())
+	else:
+		h.update('s{!r}'.format(obj).encode())
+
+def fingerprint(plot_func, plot_args, options):
+	'''Returns a hash of everything that determines the content of a plot.'''
+	h = hashlib.sha1()
+	update_hash(h, [__version__, plot_func, plot_args, options])
+	return h.hexdigest()
+
+def plot_exists(dest):
+	# matplotlib appends the file extension if dest has none
+	return os.path.exists(dest) or os.path.exists(dest + '.png')
+
+def read_manifest(plots_dir):
+	manifest_fp = os.path.join(plots_dir, MANIFEST_NAME)
+	if os.path.exists(manifest_fp):
+		try:
+			with open(manifest_fp, 'r') as f:
+				return json.loads(f.read())
+		except Exception:
+			logger.warning("plot manifest {} is corrupt, rendering all plots".format(manifest_fp))
+	return {'fingerprints':{}, 'refreshes':[]}
+
+def write_manifest(plots_dir, manifest):
+	manifest_fp = os.path.join(plots_dir, MANIFEST_NAME)
+	manifest['refreshes'] = manifest['refreshes'][-MAX_REFRESHES:]
+	with open(manifest_fp + '.tmp', 'w') as f:
+		print(json.dumps(manifest, indent=4), file=f)
+	os.replace(manifest_fp + '.tmp', manifest_fp)
+
+def filter_unchanged(plots_dir, plot_jobs, options):
+	'''Removes the plot jobs whose plot was already rendered with the same inputs. Returns the
+	remaining jobs, the manifest and the fingerprints of all plots.'''
+	manifest = read_manifest(plots_dir)
+	fingerprints = {}
+	changed = []
+	for plot_func, plot_args, dest in plot_jobs:
+		key = os.path.relpath(dest, plots_dir)
+		fingerprints[key] = fingerprint(plot_func, plot_args, options)
+		if manifest['fingerprints'].get(key) != fingerprints[key] or not plot_exists(dest):
+			changed.append( (plot_func, plot_args, dest) )
+	return changed, manifest, fingerprints
+
+def record_refresh(plots_dir, manifest, fingerprints, hits, misses):
+	'''Stores the fingerprints of the rendered plots and the hit and miss counts of this refresh.
+	Fingerprints of plots that are no longer produced are removed.'''
+	manifest['fingerprints'] = fingerprints
+	manifest['refreshes'].append({'time'	:	strftime("%Y-%m-%d %H:%M:%S", gmtime()),
+								  'hits'	:	hits,
+								  'misses'	:	misses})
+	write_manifest(plots_dir, manifest)
@@ -0,0 +1,255 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from .minknowlog import parse_timestamp
+
+DB_NAME = 'dominion.sqlite'
+LOGDATA_SUFFIX = '_logdata.json'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+	path			TEXT PRIMARY KEY,
+	mtime			INTEGER NOT NULL,
+	size			INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+	path			TEXT PRIMARY KEY,
+	asic_id_eeprom	TEXT,
+	run_id			TEXT,
+	is_qc			INTEGER NOT NULL,
+	protocol_start	TEXT,
+	experiment		TEXT,
+	sample			TEXT,
+	data			TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_flowcell ON runs (asic_id_eeprom, run_id);
+CREATE INDEX IF NOT EXISTS runs_protocol_start ON runs (is_qc, protocol_start);
+CREATE INDEX IF NOT EXISTS runs_sample ON runs (experiment, sample);
+CREATE TABLE IF NOT EXISTS mux_scans (
+	asic_id_eeprom	TEXT NOT NULL,
+	timestamp		TEXT NOT NULL,
+	path			TEXT,
+	flowcell_id		TEXT,
+	total,
+	in_use,
+	PRIMARY KEY (asic_id_eeprom, timestamp)
+);
+CREATE INDEX IF NOT EXISTS mux_scans_path ON mux_scans (path);
+'''
+
+def normalize_timestamp(timestamp):
+	'''returns the timestamp in a format that sorts chronologically, or None if it cannot be parsed'''
+	if not timestamp:
+		return None
+	try:
+		return parse_timestamp(str(timestamp)).isoformat(sep=' ', timespec='microseconds')
+	except (ValueError, OverflowError):
+		return None
+
+class RunDatabase():
+	'''Index of the logdata files of sequencing runs and platform qcs in an SQLite database. The json
+	files remain the source of truth: on synchronization, only files whose mtime or size changed
+	are read again.'''
+
+	def __init__(self, db_fp, runs_dir, qc_dir):
+		self.runs_dir = os.path.abspath(runs_dir)
+		self.qc_dir = os.path.abspath(qc_dir)
+		self.lock = threading.RLock()
+		self.logger = logging.getLogger(name='gw.db')
+		# (asic_id_eeprom, run_id) : paths of logdata files rejected as duplicates of a known run
+		self.rejected = {}
+		self.con = sqlite3.connect(db_fp, check_same_thread=False)
+		self.con.executescript(SCHEMA)
+		# live mux scans that were not (yet) saved to a logdata file are not kept across restarts
+		with self.con:
+			self.con.execute("DELETE FROM mux_scans WHERE path IS NULL")
+
+	def list_files(self, directory, levels, suffix=LOGDATA_SUFFIX):
+		'''returns the mtime and size of the logdata files in directory by path. The files are expected
+		levels subdirectories below directory, e.g. 2 for the runs directory.'''
+		files = {}
+		if not os.path.isdir(directory):
+			return files
+		for entry in os.scandir(directory):
+			if levels:
+				if entry.is_dir():
+					files.update(self.list_files(entry.path, levels-1, suffix))
+			elif entry.name.endswith(suffix) and entry.is_file():
+				stat = entry.stat()
+				files[os.path.abspath(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+		return files
+
+	def sync(self, directory=None):
+		'''brings the database in line with the logdata files, either of all runs and qcs or only of
+		an experiment or sample directory. Returns True if anything changed.'''
+		if directory is None:
+			files = self.list_files(self.qc_dir, 0, '.json')
+			files.update(self.list_files(self.runs_dir, 2))
+			query, params = "SELECT path, mtime, size FROM files", ()
+		else:
+			directory = os.path.abspath(directory)
+			levels = 2 - len(os.path.relpath(directory, self.runs_dir).split(os.sep))
+			files = self.list_files(directory, levels) if levels >= 0 else {}
+			# all paths below directory, as a range query on the primary key
+			query = "SELECT path, mtime, size FROM files WHERE path > ? AND path < ?"
+			params = (directory + os.sep, directory + chr(ord(os.sep) + 1))
+		with self.lock, self.con:
+			known = {path:(mtime, size) for path, mtime, size in self.con.execute(query, params)}
+			removed = [path for path in known if path not in files]
+			changed = [path for path in files if known.get(path) != files[path]]
+			for path in removed:
+				self.remove(path)
+			for path in sorted(changed):
+				self.add_file(path, *files[path])
+		if removed or changed:
+			self.logger.info("run database: {} files added or changed, {} removed".format(len(changed), len(removed)))
+		return bool(removed or changed)
+
+	def update_file(self, path):
+		'''re-reads a single logdata file if it changed, or removes its entries if it does not exist
+		anymore. Returns True if anything changed.'''
+		path = os.path.abspath(path)
+		with self.lock, self.con:
+			known = self.con.execute("SELECT mtime, size FROM files WHERE path = ?", (path,)).fetchone()
+			try:
+				stat = os.stat(path)
+			except OSError:
+				self.remove(path)
+				return known is not None
+			if known == (stat.st_mtime_ns, stat.st_size):
+				return False
+			self.add_file(path, stat.st_mtime_ns, stat.st_size)
+			return True
+
+	def remove(self, path):
+		'''removes the entries of a logdata file and adds files that were rejected as duplicates of
+		its run instead'''
+		run = self.con.execute("SELECT asic_id_eeprom, run_id FROM runs WHERE path = ?", (path,)).fetchone()
+		self.delete(path)
+		for rejected_path in sorted(self.rejected.pop(run, ())):
+			try:
+				stat = os.stat(rejected_path)
+			except OSError:
+				continue
+			self.add_file(rejected_path, stat.st_mtime_ns, stat.st_size)
+
+	def delete(self, path):
+		for table in ['files', 'runs', 'mux_scans']:
+			self.con.execute("DELETE FROM {} WHERE path = ?".format(table), (path,))
+
+	def add_file(self, path, mtime, size):
+		self.delete(path)
+		try:
+			with open(path, 'r') as f:
+				flowcell, run_data, mux_scans = json.loads(f.read(), object_pairs_hook=OrderedDict)
+			asic_id_eeprom = flowcell['asic_id_eeprom']
+			run_id = run_data['run_id']
+		except Exception:
+			self.logger.warning("failed to parse {}, json format or data structure corrupt".format(path))
+			# recorded nonetheless, such that the file is only read again if it changes
+			self.con.execute("INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, mtime, size))
+			return
+
+		is_qc = os.path.dirname(path) == self.qc_dir
+		if not is_qc:
+			# attributes experiment and sample are determined by the directory names
+			sample_dir = os.path.dirname(path)
+			run_data['experiment'] = os.path.basename(os.path.dirname(sample_dir))
+			run_data['sample'] = os.path.basename(sample_dir)
+			conflict = self.con.execute("SELECT path FROM runs WHERE asic_id_eeprom = ? AND run_id = ? AND path != ?",
+										(asic_id_eeprom, run_id, path)).fetchone()
+			if conflict:
+				self.logger.warning("{} exists multiple times in database!".format(run_id))
+				self.logger.warning("conflicting runs: {}, {}".format(conflict[0], path))
+				self.logger.error("failed to add content from {} to the database".format(path))
+				# not recorded, such that it is added once the conflicting run is removed
+				self.rejected.setdefault((asic_id_eeprom, run_id), set()).add(path)
+				return
+			is_qc = 'qc' in (run_data.get('experiment_type') or '').lower()
+
+		self.con.execute("INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, mtime, size))
+		self.con.execute('''INSERT INTO runs (path, asic_id_eeprom, run_id, is_qc, protocol_start, experiment, sample, data)
+							VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+						 (path, asic_id_eeprom, run_id, int(is_qc), normalize_timestamp(run_data.get('protocol_start')),
+						  run_data.get('experiment'), run_data.get('sample'), json.dumps((flowcell, run_data, mux_scans))))
+		self.insert_mux_scans(flowcell, mux_scans, path)
+		self.logger.debug('{} - added experiment of type "{}" performed on flowcell "{}" on "{}"'.format(asic_id_eeprom,
+																										 run_data.get('experiment_type'),
+																										 flowcell.get('flowcell_id'),
+																										 run_data.get('protocol_start')))
+
+	def add_mux_scans(self, flowcell, mux_scans):
+		'''adds mux scan results of a flowcell from the log files of a running experiment. They are
+		replaced once they are saved to a logdata file.'''
+		with self.lock, self.con:
+			self.insert_mux_scans(flowcell, mux_scans)
+
+	def insert_mux_scans(self, flowcell, mux_scans, path=None):
+		rows = []
+		for mux_scan in mux_scans:
+			total = mux_scan['total'] if 'total' in mux_scan else mux_scan.get('group * total')
+			timestamp = normalize_timestamp(mux_scan.get('timestamp'))
+			if total is None or timestamp is None:
+				continue
+			rows.append( (flowcell['asic_id_eeprom'], timestamp, path, flowcell['flowcell_id'], total, mux_scan.get('in_use')) )
+		self.con.executemany('''INSERT OR REPLACE INTO mux_scans (asic_id_eeprom, timestamp, path, flowcell_id, total, in_use)
+								VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+	def get_runs_by_flowcell(self, asic_id_eeprom):
+		'''returns the flowcell, run data and mux scans of all sequencing runs performed on a flowcell'''
+		runs = OrderedDict()
+		if not asic_id_eeprom:
+			return runs
+		with self.lock:
+			rows = self.con.execute('''SELECT run_id, data FROM runs WHERE asic_id_eeprom = ? AND is_qc = 0
+									   ORDER BY protocol_start''', (asic_id_eeprom,)).fetchall()
+		for run_id, data in rows:
+			flowcell, run_data, mux_scans = json.loads(data, object_pairs_hook=OrderedDict)
+			runs[run_id] = {'flowcell'	: flowcell,
+							'run_data'	: run_data,
+							'mux_scans'	: mux_scans}
+		return runs
+
+	def get_latest_mux_scan_result(self, asic_id_eeprom):
+		'''returns the most recent mux scan result of a flowcell, or None'''
+		if not asic_id_eeprom:
+			return None
+		with self.lock:
+			row = self.con.execute('''SELECT timestamp, flowcell_id, total, in_use FROM mux_scans WHERE asic_id_eeprom = ?
+									  ORDER BY timestamp DESC LIMIT 1''', (asic_id_eeprom,)).fetchone()
+		if not row:
+			return None
+		result = OrderedDict([('timestamp', parse_timestamp(row[0])),
+							  ('flowcell_id', row[1]),
+							  ('total', row[2])])
+		if row[3] is not None:
+			result['in_use'] = row[3]
+		return result
+
+	def get_runs(self, limit=0):
+		'''returns the run data of the most recent sequencing runs, newest first. A limit of 0 returns
+		all runs.'''
+		with self.lock:
+			rows = self.con.execute('''SELECT run_id, data FROM runs WHERE is_qc = 0
+									   ORDER BY protocol_start DESC LIMIT ?''', (limit if limit > 0 else -1,)).fetchall()
+		return [(run_id, json.loads(data, object_pairs_hook=OrderedDict)[1]) for run_id, data in rows]
+
+	def close(self):
+		with self.lock:
+			self.con.close()
@@ -0,0 +1,308 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io
+import os
+import json
+import hashlib
+import logging
+import shutil
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .aggregates import LengthSketch, merge_sketches, SKETCH_ERROR
+
+CACHE_VERSION = 4
+# number of leading bytes of a stats file, and of bytes before the parsed offset, that are remembered
+# to recognize truncated or replaced files
+HEAD_SIZE = 1024
+# typed columns of the cache, each stored as raw binary file that is memory-mapped when read
+COLUMNS = OrderedDict([('bases',		np.float32),
+					   ('qual',			np.float32),
+					   ('gc',			np.float32),
+					   ('pore_num',		np.int64),
+					   ('pore',			np.int32),
+					   ('time',			np.int64), # nanoseconds since epoch
+					   ('barcode',		np.int16), # codes of categories
+					   ('subset',		np.int16)])
+CATEGORICAL_COLUMNS = ['barcode', 'subset']
+NUMERIC_COLUMNS = ['bases', 'qual', 'gc', 'pore_num', 'pore']
+AGGREGATE_COLUMNS = ['reads', 'bases', 'qual_sum', 'gc_sum', 'longest', 'lengths']
+# format of the start_time attribute of reads written by MinKNOW
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+logger = logging.getLogger(name='sp.sc')
+
+def get_cache_dir(stats_fp):
+	return (stats_fp[:-len('.csv')] if stats_fp.endswith('.csv') else stats_fp) + '.cache'
+
+def empty_meta():
+	return {'version'		:	CACHE_VERSION,
+			'offset'		:	0,
+			'rows'			:	0,
+			'inode'			:	None,
+			'head_size'		:	0,
+			'head_sha1'		:	None,
+			'tail_sha1'		:	None,
+			'categories'	:	{col:[] for col in CATEGORICAL_COLUMNS},
+			'sketch_error'	:	None,
+			'aggregates'	:	[]}
+
+def empty_aggregates():
+	index = pd.MultiIndex.from_tuples([], names=['barcode', 'subset'])
+	return pd.DataFrame(columns=AGGREGATE_COLUMNS, index=index, dtype=float)
+
+def aggregates_to_records(aggregates):
+	return [list(idx) + [float(aggregates.at[idx, col]) for col in AGGREGATE_COLUMNS[:-1]] + 
+			[aggregates.at[idx, 'lengths'].to_record()] for idx in aggregates.index]
+
+def aggregates_from_records(records):
+	if not records:
+		return empty_aggregates()
+	index = pd.MultiIndex.from_tuples([tuple(rec[:2]) for rec in records], names=['barcode', 'subset'])
+	aggregates = pd.DataFrame([rec[2:-1] for rec in records], index=index, columns=AGGREGATE_COLUMNS[:-1], dtype=float)
+	aggregates['lengths'] = [LengthSketch.from_record(rec[-1]) for rec in records]
+	return aggregates
+
+def read_meta(cache_dir):
+	meta_fp = os.path.join(cache_dir, 'meta.json')
+	if not os.path.exists(meta_fp):
+		return empty_meta()
+	try:
+		with open(meta_fp, 'r') as f:
+			meta = json.loads(f.read())
+	except Exception:
+		logger.warning("cache {} is corrupt, parsing the stats file from the beginning".format(cache_dir))
+		return empty_meta()
+	if meta.get('version') != CACHE_VERSION:
+		logger.info("cache {} was written by a different version, parsing the stats file from the beginning".format(cache_dir))
+		return empty_meta()
+	for col in COLUMNS:
+		fp = os.path.join(cache_dir, col)
+		size = os.path.getsize(fp) if os.path.exists(fp) else 0
+		expected_size = meta['rows'] * np.dtype(COLUMNS[col]).itemsize
+		if size < expected_size:
+			logger.warning("column {} of cache {} is incomplete, parsing the stats file from the beginning".format(col, cache_dir))
+			return empty_meta()
+		elif size > expected_size:
+			# rows appended by an update that did not finish
+			os.truncate(fp, expected_size)
+	return meta
+
+def write_meta(cache_dir, meta):
+	meta_fp = os.path.join(cache_dir, 'meta.json')
+	with open(meta_fp + '.tmp', 'w') as f:
+		print(json.dumps(meta), file=f)
+	os.replace(meta_fp + '.tmp', meta_fp)
+
+def reset_cache(cache_dir):
+	if os.path.exists(cache_dir):
+		shutil.rmtree(cache_dir)
+	os.makedirs(cache_dir)
+
+def read_tail(f, offset):
+	'''Returns the HEAD_SIZE bytes of the opened stats file before offset.'''
+	f.seek(max(offset - HEAD_SIZE, 0))
+	return f.read(min(offset, HEAD_SIZE))
+
+def is_continuation(meta, f, stat):
+	'''Checks if the opened stats file is the same file that meta refers to, i.e. that
+	rows were only appended to it since the cache was written. watchnchop truncates the stats
+	file in place on a restart, so besides the leading bytes, the bytes before the parsed offset
+	must be unchanged and end with a complete row.'''
+	if not meta['offset']:
+		return True
+	if stat.st_ino != meta['inode'] or stat.st_size < meta['offset']:
+		return False
+	f.seek(0)
+	if hashlib.sha1(f.read(meta['head_size'])).hexdigest() != meta['head_sha1']:
+		return False
+	tail = read_tail(f, meta['offset'])
+	return tail.endswith(b'\n') and hashlib.sha1(tail).hexdigest() == meta['tail_sha1']
+
+def parse_timestamps(values):
+	'''Parses a Series of ISO 8601 timestamps in bulk. Timestamps that deviate from the format
+	written by MinKNOW are parsed in a second pass, timestamps that can not be parsed are NaT.'''
+	times = pd.to_datetime(values, format=TIME_FORMAT, errors='coerce', utc=True)
+	deviating = times.isna() & values.notna()
+	if deviating.any():
+		times[deviating] = pd.to_datetime(values[deviating], errors='coerce', utc=True)
+	return times
+
+def parse_stats_chunk(buffer):
+	'''Parses complete lines of a stats file. Rows containing malformed values are removed.'''
+	kwargs = {'sep'		:	'\t',
+			  'header'	:	None,
+			  'names'	:	"id bases qual gc subset pore_num pore time barcode".split(" "),
+			  'usecols'	:	[1,2,3,4,5,6,7,8]}
+	try:
+		df = pd.read_csv(io.BytesIO(buffer), 
+						 dtype={'bases':float, 'qual':float, 'gc':float, 'pore_num':float, 'pore':float,
+								'time':str, 'subset':str, 'barcode':str},
+						 **kwargs)
+	except ValueError:
+		# at least one numeric column contains a malformed value, parse them separately
+		df = pd.read_csv(io.BytesIO(buffer), dtype=str, **kwargs)
+		for col in NUMERIC_COLUMNS:
+			df[col] = pd.to_numeric(df[col], errors='coerce')
+	df['time'] = parse_timestamps(df['time'])
+
+	malformed = df['time'].isna().values
+	for col in NUMERIC_COLUMNS:
+		malformed |= np.isnan(df[col].values)
+	for col in CATEGORICAL_COLUMNS:
+		malformed |= df[col].isna().values
+	if malformed.any():
+		logger.warning("skipping {} malformed row{} in stats file".format(malformed.sum(), 's' if malformed.sum()>1 else ''))
+		df = df[~malformed]
+	df = df.astype({'pore_num':np.int64, 'pore':np.int64})
+	return df.reset_index(drop=True)
+
+def to_columns(df, categories):
+	'''Converts the parsed rows to the typed columns of the cache. New categories of
+	categorical columns are appended to the category lists in categories.'''
+	columns = {}
+	for col in COLUMNS:
+		if col in CATEGORICAL_COLUMNS:
+			for value in df[col].unique():
+				if value not in categories[col]:
+					categories[col].append(value)
+			columns[col] = pd.Categorical(df[col], categories=categories[col]).codes.astype(COLUMNS[col])
+		elif col == 'time':
+			columns[col] = pd.to_datetime(df[col], utc=True).values.astype('datetime64[ns]').view(np.int64)
+		else:
+			columns[col] = df[col].values.astype(COLUMNS[col])
+	return columns
+
+def append_columns(cache_dir, columns):
+	for col in COLUMNS:
+		with open(os.path.join(cache_dir, col), 'ab') as f:
+			f.write(np.ascontiguousarray(columns[col]).tobytes())
+
+def map_columns(cache_dir, rows):
+	'''Memory-maps the cached columns.'''
+	if not rows:
+		return {col:np.empty(0, dtype=COLUMNS[col]) for col in COLUMNS}
+	return {col:np.memmap(os.path.join(cache_dir, col), dtype=COLUMNS[col], mode='r', shape=(rows,)) for col in COLUMNS}
+
+def to_dataframe(columns, categories):
+	'''Creates a DataFrame indexed by barcode, subset and pore from the cached columns.'''
+	index = pd.MultiIndex.from_arrays([np.array(categories['barcode'], dtype=object)[columns['barcode']],
+									   np.array(categories['subset'], dtype=object)[columns['subset']],
+									   np.asarray(columns['pore'])],
+									  names=['barcode', 'subset', 'pore'])
+	return pd.DataFrame(OrderedDict((('bases',		columns['bases'].astype(float)),
+									 ('qual',		columns['qual'].astype(float)),
+									 ('gc',			columns['gc'].astype(float)),
+									 ('pore_num',	np.asarray(columns['pore_num'])),
+									 ('time',		pd.to_datetime(np.asarray(columns['time']), utc=True)))),
+						index=index)
+
+def aggregate(df, sketch_error=SKETCH_ERROR):
+	'''Aggregates the reads of df per barcode and subset into values that can be merged with
+	the aggregates of other reads by simple addition, maximum and merging of length sketches.'''
+	subgrouped = df.groupby(['barcode', 'subset'])
+	return pd.DataFrame({'reads'	:	subgrouped['bases'].count().astype(float),
+						 'bases'	:	subgrouped['bases'].sum(),
+						 'qual_sum'	:	subgrouped['qual'].sum(),
+						 'gc_sum'	:	subgrouped['gc'].sum(),
+						 'longest'	:	subgrouped['bases'].max(),
+						 'lengths'	:	subgrouped['bases'].agg(lambda lengths: LengthSketch.from_lengths(lengths.values, sketch_error))},
+						columns=AGGREGATE_COLUMNS)
+
+def combine_aggregates(aggregates, level):
+	return aggregates.groupby(level=level).agg({'reads'		:	'sum',
+												'bases'		:	'sum',
+												'qual_sum'	:	'sum',
+												'gc_sum'	:	'sum',
+												'longest'	:	'max',
+												'lengths'	:	merge_sketches})[AGGREGATE_COLUMNS]
+
+def merge_aggregates(aggregates_list):
+	aggregates_list = [agg for agg in aggregates_list if not agg.empty]
+	if not aggregates_list:
+		return empty_aggregates()
+	return combine_aggregates(pd.concat(aggregates_list), ['barcode', 'subset'])
+
+def expand_aggregates(aggregates):
+	'''Adds the aggregates of the pseudo barcode 'All' and of the pseudo subset 'all' to the
+	aggregates per barcode and subset.'''
+	all_barcodes = combine_aggregates(aggregates, 'subset')
+	all_barcodes.index = pd.MultiIndex.from_tuples([('All', subset) for subset in all_barcodes.index],
+												   names=['barcode', 'subset'])
+	aggregates = pd.concat([aggregates, all_barcodes])
+	all_subsets = combine_aggregates(aggregates, 'barcode')
+	all_subsets.index = pd.MultiIndex.from_tuples([(barcode, 'all') for barcode in all_subsets.index],
+												  names=['barcode', 'subset'])
+	return pd.concat([aggregates, all_subsets])
+
+def load_stats(stats_fp, sketch_error=SKETCH_ERROR):
+	'''Returns all reads of stats file stats_fp and their aggregates per barcode and subset.
+	Rows that were already parsed in a previous call are memory-mapped from the columnar cache
+	next to the stats file, such that only the rows appended since then need to be parsed.
+	sketch_error is the relative error of the length sketches of the aggregates.'''
+	cache_dir = get_cache_dir(stats_fp)
+	meta = read_meta(cache_dir)
+	with open(stats_fp, 'rb') as f:
+		stat = os.fstat(f.fileno())
+		if not is_continuation(meta, f, stat):
+			logger.info("stats file {} was replaced or truncated, parsing it from the beginning".format(stats_fp))
+			meta = empty_meta()
+		f.seek(meta['offset'])
+		buffer = f.read()
+		# the last line might still be incomplete if the stats file is being written to
+		buffer = buffer[:buffer.rfind(b'\n')+1]
+		tail = read_tail(f, meta['offset'] + len(buffer)) if buffer else None
+
+	if meta['rows'] and meta['sketch_error'] != sketch_error:
+		logger.info("rebuilding length sketches of cache {} with relative error {}".format(cache_dir, sketch_error))
+		aggregates = aggregate(to_dataframe(map_columns(cache_dir, meta['rows']), meta['categories']), sketch_error)
+		meta['aggregates'] = aggregates_to_records(aggregates)
+		meta['sketch_error'] = sketch_error
+		try:
+			write_meta(cache_dir, meta)
+		except OSError as e:
+			logger.warning("failed to write cache {}: {}".format(cache_dir, e))
+	aggregates = aggregates_from_records(meta['aggregates'])
+	if buffer:
+		logger.debug("parsing {} new bytes of stats file {} starting at offset {}".format(len(buffer), stats_fp, meta['offset']))
+		cached_rows = meta['rows']
+		new_df = parse_stats_chunk(buffer)
+		columns = to_columns(new_df, meta['categories'])
+		aggregates = merge_aggregates([aggregates, aggregate(new_df, sketch_error)])
+		try:
+			if not meta['offset']:
+				reset_cache(cache_dir)
+				meta['head_size'] = min(len(buffer), HEAD_SIZE)
+				meta['head_sha1'] = hashlib.sha1(buffer[:HEAD_SIZE]).hexdigest()
+			append_columns(cache_dir, columns)
+			meta['aggregates'] = aggregates_to_records(aggregates)
+			meta['sketch_error'] = sketch_error
+			meta['offset'] += len(buffer)
+			meta['tail_sha1'] = hashlib.sha1(tail).hexdigest()
+			meta['rows'] += len(new_df)
+			meta['inode'] = stat.st_ino
+			write_meta(cache_dir, meta)
+		except OSError as e:
+			# the meta file still refers to the previously cached rows, the new rows are parsed again next time
+			logger.warning("failed to write cache {}: {}".format(cache_dir, e))
+			cached = map_columns(cache_dir, cached_rows)
+			columns = {col:np.concatenate([cached[col], columns[col]]) for col in COLUMNS}
+			if not len(columns['bases']):
+				return None, aggregates
+			return to_dataframe(columns, meta['categories']), aggregates
+	else:
+		logger.debug("no new rows in stats file {}".format(stats_fp))
+
+	if not meta['rows']:
+		return None, aggregates
+	return to_dataframe(map_columns(cache_dir, meta['rows']), meta['categories']), aggregates
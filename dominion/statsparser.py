@@ -23,8 +23,13 @@ import math
 import pandas as pd
 from collections import OrderedDict
 import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+import traceback
 import matplotlib
-import matplotlib.pyplot as plt
+import matplotlib.style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.colors as colors
 import matplotlib.lines as mlines
 import matplotlib.gridspec as gridspec
@@ -36,6 +41,10 @@ from shutil import copyfile
 import warnings
 from .version import __version__
 from .helper import initLogger, package_dir, ArgHelpFormatter, r_file, r_dir, w_dir, resources_dir, jinja_env
+from .statscache import load_stats, merge_aggregates, expand_aggregates
+from .aggregates import SKETCH_ERROR
+from .binning import Binning, cumulative_curve
+from .plotcache import filter_unchanged, record_refresh
 import json
 import logging
 from jinja2 import Environment, PackageLoader, select_autoescape
@@ -43,6 +52,8 @@ from jinja2 import Environment, PackageLoader, select_autoescape
 warnings.filterwarnings("ignore")
 TICKLBLS = 6
 SECS_TO_HOURS = 3600.
+# subdirectories created by statsparser
+OUTPUT_DIRS = ['res', 'plots']
 logger = None
 
 class parse_time_intervals(argparse.Action):
@@ -77,11 +88,28 @@ def get_argument_parser():
 		main_options.add_argument('-r', '--recursive',
 								  action='store_true',
 								  help='''recursively search for directories containing stats files and corresponding logdata files''')
+		main_options.add_argument('-j', '--jobs',
+								  type=int,
+								  default=1,
+								  help='''number of directories processed in parallel if --recursive is set''')
+		main_options.add_argument('--force',
+								  action='store_true',
+								  help='''with --recursive, also create reports that are newer than the stats and logdata files of their directory''')
+		main_options.add_argument('--dir_index',
+								  help='''with --recursive, cache the directory structure in this json file and only rescan directories 
+								  	   that were modified since the last run''')
+		main_options.add_argument('--summary',
+								  help='''with --recursive, write a json file summarizing the duration and outcome of each directory to this path''')
 
 	main_options.add_argument('--html_refresh_rate',
 							  type=int,
 							  default=120,
 							  help='refresh rate of the html page in seconds')
+	main_options.add_argument('--sketch_error',
+							  type=float,
+							  default=SKETCH_ERROR,
+							  help='''maximum relative error of the median read length and the mean length of the longest
+							  	   half of reads, which are derived from histograms of read lengths''')
 
 	plot_options = argument_parser.add_argument_group('Plotting options',
 													  'Arguments changing the appearance of plots')
@@ -106,7 +134,8 @@ def get_argument_parser():
 							  help='matplotlib style string that influences all colors and plot appearances')
 	plot_options.add_argument('--dpi',
 							  type=int,
-							  default=150)
+							  default=100,
+							  help='resolution of figures in dots per inch')
 	plot_options.add_argument('--width',
 							  type=float,
 							  default=6.4,
@@ -115,6 +144,14 @@ def get_argument_parser():
 							  type=float,
 							  default=4.8,
 							  help='height of figure in inches')
+	plot_options.add_argument('--curve_points',
+							  type=int,
+							  default=1000,
+							  help='number of points of the cumulative reads and bases curves')
+	plot_options.add_argument('--plot_workers',
+							  type=int,
+							  default=1,
+							  help='number of processes rendering plots in parallel')
 
 	help_group = argument_parser.add_argument_group('Help')
 	help_group.add_argument('-h', '--help', 
@@ -134,15 +171,58 @@ def get_argument_parser():
 
 	return argument_parser
 
-def contains_stats_and_logdata(directory):
-	files = [i for i in os.listdir(directory) if os.path.isfile(os.path.join(directory,i))]
+def is_output_dir(name):
+	'''Checks if a subdirectory of a sample directory is written by statsparser itself and can not
+	contain stats files.'''
+	return name in OUTPUT_DIRS or name.endswith('_stats.cache')
+
+def has_stats_and_logdata(files):
 	run_ids = [f.split("_")[0] for f in files if f.endswith("_stats.csv")]
 	for run_id in run_ids:
 		if "{}_logdata.json".format(run_id) in files:
 			return True
 	return False
 
-def get_dir_list(input_path, recursive):
+def scan_dir(directory, index):
+	'''Lists directory with a single os.scandir call and returns whether it contains a stats file
+	with its logdata file, as well as the names of its subdirectories, including symlinked ones.
+	Output directories are left out in sample directories, where statsparser writes them. The
+	result is stored in index and reused as long as the modification time of directory does not
+	change.'''
+	mtime = os.stat(directory).st_mtime_ns
+	if directory in index and index[directory][0] == mtime:
+		return index[directory][1], index[directory][2]
+	files, subdirs = [], []
+	with os.scandir(directory) as entries:
+		for entry in entries:
+			if entry.is_file():
+				files.append(entry.name)
+			elif entry.is_dir():
+				subdirs.append(entry.name)
+	contains = has_stats_and_logdata(files)
+	if contains:
+		subdirs = [subdir for subdir in subdirs if not is_output_dir(subdir)]
+	index[directory] = [mtime, contains, subdirs]
+	return contains, subdirs
+
+def contains_stats_and_logdata(directory):
+	return scan_dir(directory, {})[0]
+
+def read_dir_index(index_fp):
+	if index_fp and os.path.exists(index_fp):
+		try:
+			with open(index_fp, 'r') as f:
+				return json.loads(f.read())
+		except Exception:
+			logger.warning("directory index {} is corrupt, scanning all directories".format(index_fp))
+	return {}
+
+def write_dir_index(index_fp, index):
+	with open(index_fp + '.tmp', 'w') as f:
+		print(json.dumps(index), file=f)
+	os.replace(index_fp + '.tmp', index_fp)
+
+def get_dir_list(input_path, recursive, index_fp=None):
 	input_dirs = []
 	if not os.path.exists(input_path):
 		logger.error('path {} does not exist'.format(input_path))
@@ -151,14 +231,26 @@ def get_dir_list(input_path, recursive):
 		if contains_stats_and_logdata(os.path.dirname(input_path)):
 			input_dirs.append(os.path.dirname(input_path))
 	elif os.path.isdir(input_path):
-		if contains_stats_and_logdata(input_path):
-			input_dirs.append(input_path)
-		if recursive:
-			for root, dirs, _ in os.walk(input_path):
-				for subdir in dirs:
-					dir_path = os.path.join(root, subdir)
-					if contains_stats_and_logdata(dir_path):
-						input_dirs.append(dir_path)
+		old_index = read_dir_index(index_fp) if recursive else {}
+		index = {}
+		to_scan = [input_path]
+		# real paths of scanned directories, such that symlink cycles are not followed forever
+		visited = set()
+		while to_scan:
+			directory = to_scan.pop()
+			real_path = os.path.realpath(directory)
+			if real_path in visited:
+				continue
+			visited.add(real_path)
+			if directory in old_index:
+				index[directory] = old_index[directory]
+			contains, subdirs = scan_dir(directory, index)
+			if contains:
+				input_dirs.append(directory)
+			if recursive:
+				to_scan.extend([os.path.join(directory, subdir) for subdir in sorted(subdirs, reverse=True)])
+		if index_fp and recursive:
+			write_dir_index(index_fp, index)
 	return input_dirs
 
 def parse_args(argument_parser, ext_args=None):
@@ -178,19 +270,18 @@ def parse_args(argument_parser, ext_args=None):
 	initLogger(level=loglvl)
 	logger = logging.getLogger(name='sp')
 
+	if args.curve_points < 1:
+		argument_parser.error('argument --curve_points: must be at least 1, got {}'.format(args.curve_points))
 	args.time_intervals = [i*60 for i in args.time_intervals]
 
-	input_dirs = get_dir_list(args.input, args.recursive)
-	for input_dir in list(input_dirs):
-		if not os.access(input_dir, os.W_OK):
-			logger.warning("excluding directory {} due to missing write permissions".format(input_dir))
-			input_dirs.remove(input_dir)
-	args.input = input_dirs
-
-	global fig_dpi, fig_width, fig_height
-	fig_height = args.height
-	fig_width = args.width
-	fig_dpi = args.dpi
+	# the input argument only exists if statsparser is executed as a script
+	if 'input' in args:
+		input_dirs = get_dir_list(args.input, args.recursive, args.dir_index)
+		for input_dir in list(input_dirs):
+			if not os.access(input_dir, os.W_OK):
+				logger.warning("excluding directory {} due to missing write permissions".format(input_dir))
+				input_dirs.remove(input_dir)
+		args.input = input_dirs
 
 	return args
 
@@ -250,73 +341,57 @@ def main(args, input_dir):
 	logger.info("Parsing stats files from directory {}".format(input_dir))
 	stats_files, logdata_files = get_input_files(input_dir)
 
-	df = parse_stats(stats_files)
+	df, aggregates = parse_stats(stats_files, args.sketch_error)
 
 	logger.info("Creating stats table")
-	stats_df = stats_table(df)
+	stats_df = stats_table(aggregates)
 
-	subgrouped = df.groupby(['barcode', 'subset'])
-	indexes = list(pd.DataFrame(subgrouped['bases'].count()).index)
+	# only the stats table is built from aggregates that are merged incrementally. The box plots
+	# need exact quantiles per time bin, and the time, kb and gc bins as well as the sampling
+	# positions of the cumulative curves depend on the range of all values, so these plots are
+	# still created from all rows
+	subgrouped = SubgroupView(df)
+	indexes = subgrouped.indexes
 
-	#######
-
-	logger.info("Creating boxplots")
-	for bc, subset in indexes:
-		sub_df = subgrouped.get_group( (bc, subset) ).sort_values('time', axis=0, ascending=True)
-		interval, offset, num_bins = get_lowest_possible_interval(args.time_intervals,
-																  args.max_bins, 
-																  sub_df['time'].min(), 
-																  sub_df['time'].max())
-		bin_edges = get_bin_edges(sub_df['time'], interval)
-		for col in sub_df:
-			if col.lower() in ['bases','gc','qual']:
-				ylbl = get_label(col)
-				logger.debug("...plotting {}, {}: {}".format(bc, subset, ylbl))
-				bins = get_bins(sub_df[col], bin_edges)
-				intervals = [(offset+i)*interval for i in range(len(bins))]
-				boxplot(bins, 
-						intervals, 
-						interval, 
-						ylbl, 
-						os.path.join(input_dir, 'res', "plots", "boxplot_{}_{}_{}".format(bc, subset, col)))
+	# plots are collected as tuples of a plot function, its arguments and the destination of the
+	# plot and rendered afterwards
+	plot_jobs = []
 
 	#######
-	
-	logger.info("Creating kb-bins barplots")
-	for bc, subset in indexes:
-		sub_df = subgrouped.get_group( (bc, subset) ).sort_values('bases', axis=0, ascending=True)
-		interval, offset, num_bins = get_lowest_possible_interval(list(np.array(args.kb_intervals)*1000),
-																  args.max_bins, 
-																  sub_df['bases'].min(), 
-																  sub_df['bases'].max())
-		bin_edges = get_bin_edges(sub_df['bases'], interval)
-		logger.debug("...plotting {}, {}".format(bc, subset))
-		#bins = get_bins(sub_df['bases']/1000000., bin_edges)
-		bins = get_bins(sub_df['bases'], bin_edges)
-		intervals = [((offset+i)*interval)/1000. for i in range(len(bins))]
-		barplot(bins, 
-				intervals, 
-				interval/1000.,
-				os.path.join(input_dir, 'res', "plots", "barplot_kb-bins_{}_{}".format(bc, subset)))
-	
-	#######
-	
-	logger.info("Creating gc-bins barplots")
+
+	logger.info("Creating boxplots, kb-bins barplots and gc-bins lineplots")
+	kb_intervals = list(np.array(args.kb_intervals)*1000)
 	for bc, subset in indexes:
-		sub_df = subgrouped.get_group( (bc, subset) ).sort_values('gc', axis=0, ascending=True)
-		interval, offset, num_bins = get_lowest_possible_interval([args.gc_interval],
-																  args.max_bins, 
-																  sub_df['gc'].min(), 
-																  sub_df['gc'].max())
-		bin_edges = get_bin_edges(sub_df['gc'], interval)
-		logger.debug("...plotting {}, {}".format(bc, subset))
-		#bins = get_bins(sub_df['bases']/1000000., bin_edges)
-		bins = get_bins(sub_df['bases'], bin_edges)
-		intervals = [(offset+i)*interval for i in range(len(bins))]
-		gc_lineplot(bins, 
-					intervals, 
-					interval,  
-					os.path.join(input_dir, 'res', "plots", "barplot_gc-bins_{}_{}".format(bc, subset)))
+		sub_df = subgrouped.get_group( (bc, subset) )
+		bases = sub_df['bases'].values
+
+		time_binning = Binning.from_intervals(sub_df['time'].values, args.time_intervals, args.max_bins)
+		intervals = list(time_binning.lower_edges)
+		for col in ['bases', 'qual', 'gc']:
+			ylbl = get_label(col)
+			logger.debug("...plotting {}, {}: {}".format(bc, subset, ylbl))
+			box_stats = time_binning.box_stats(sub_df[col].values)
+			plot_jobs.append( (boxplot, (box_stats, 
+										 intervals, 
+										 time_binning.interval, 
+										 ylbl), 
+							   os.path.join(input_dir, 'res', "plots", "boxplot_{}_{}_{}".format(bc, subset, col))) )
+
+		kb_binning = Binning.from_intervals(bases, kb_intervals, args.max_bins)
+		logger.debug("...plotting {}, {}: kb-bins".format(bc, subset))
+		plot_jobs.append( (barplot, (kb_binning.counts,
+									 kb_binning.sums(bases),
+									 list(kb_binning.lower_edges/1000.), 
+									 kb_binning.interval/1000.),
+						   os.path.join(input_dir, 'res', "plots", "barplot_kb-bins_{}_{}".format(bc, subset))) )
+
+		gc_binning = Binning.from_intervals(sub_df['gc'].values, [args.gc_interval], args.max_bins)
+		logger.debug("...plotting {}, {}: gc-bins".format(bc, subset))
+		plot_jobs.append( (gc_lineplot, (gc_binning.counts,
+										 gc_binning.sums(bases),
+										 list(gc_binning.lower_edges), 
+										 gc_binning.interval),
+						   os.path.join(input_dir, 'res', "plots", "barplot_gc-bins_{}_{}".format(bc, subset))) )
 
 	#######
 	
@@ -325,51 +400,50 @@ def main(args, input_dir):
 	subset_l, subset_q, subset_p, _ = get_subset_names(indexes)
 	bcs = list(set([bc for bc,_ in indexes]))
 	bcs.sort()
-	adapter_bin_barplots(stats_df, bcs, subset_l, subset_q, subset_p, os.path.join(input_dir, 'res', "plots", "adapter_bin_barplot.png"))
+	plot_jobs.append( (adapter_bin_barplots, (stats_df, bcs, subset_l, subset_q, subset_p),
+					   os.path.join(input_dir, 'res', "plots", "adapter_bin_barplot.png")) )
 
 	#######
 	
 	logger.info("Creating multi lineplots with one y-axis")
-	grouped = df.groupby(['barcode'])
-	
 	reads_dfs = []
 	bases_dfs = []
 	
-	sorted_df = grouped.get_group( 'All' ).sort_values('time', axis=0, ascending=True)
-
-	sorted_reads_df = pd.DataFrame({'count':range(1,sorted_df['time'].size+1)})
-	reads_scaling_factor, reads_unit = choose_scaling_factor(sorted_reads_df.iat[-1,-1], [10**6 ,10**3, 1], ['M', 'k', '-'])
-	sorted_bases_df = (sorted_df['bases']).expanding(1).sum()
-	bases_scaling_factor, bases_unit = choose_scaling_factor(sorted_bases_df.iat[-1], [10**9, 10**6, 10**3], ['Gb', 'Mb', 'kb'])
-
-	reads_dfs.append( (sorted_df['time']/SECS_TO_HOURS, 
-					  sorted_reads_df,
-					  'all') )
-	bases_dfs.append( (sorted_df['time']/SECS_TO_HOURS, 
-					  sorted_bases_df,
-					  'all') )
+	end = df['time'].max()
+	time, reads = cumulative_curve(df['time'].values, end, args.curve_points)
+	_, bases = cumulative_curve(df['time'].values, end, args.curve_points, weights=df['bases'].values)
+	reads_scaling_factor, reads_unit = choose_scaling_factor(reads[-1], [10**6 ,10**3, 1], ['M', 'k', '-'])
+	bases_scaling_factor, bases_unit = choose_scaling_factor(bases[-1], [10**9, 10**6, 10**3], ['Gb', 'Mb', 'kb'])
+	reads_dfs.append( (time/SECS_TO_HOURS, reads, 'all') )
+	bases_dfs.append( (time/SECS_TO_HOURS, bases, 'all') )
 
 	ordered_subsets = get_ordered_subsets(indexes)
 	for subset in ordered_subsets:
-		sorted_df = subgrouped.get_group( ('All',subset) ).sort_values('time', axis=0, ascending=True)
-		reads_dfs.append( (sorted_df['time']/SECS_TO_HOURS, 
-						  pd.DataFrame({'count':range(1,sorted_df['time'].size+1)}),
-						  subset) )
-		bases_dfs.append( (sorted_df['time']/SECS_TO_HOURS, 
-						  (sorted_df['bases']).expanding(1).sum(),
-						  subset) )
+		sub_df = subgrouped.get_group( ('All',subset) )
+		time, reads = cumulative_curve(sub_df['time'].values, end, args.curve_points)
+		_, bases = cumulative_curve(sub_df['time'].values, end, args.curve_points, weights=sub_df['bases'].values)
+		reads_dfs.append( (time/SECS_TO_HOURS, reads, subset) )
+		bases_dfs.append( (time/SECS_TO_HOURS, bases, subset) )
 	logger.debug("...plotting {}".format('reads'))
-	lineplot_multi(reads_dfs, 
-				   "reads [{}]",
-				   os.path.join(input_dir, 'res', "plots", "multi_lineplot_{}".format('reads')),
-				   reads_scaling_factor,
-				   reads_unit)
+	plot_jobs.append( (lineplot_multi, (reads_dfs, 
+										"reads [{}]",
+										reads_scaling_factor,
+										reads_unit),
+					   os.path.join(input_dir, 'res', "plots", "multi_lineplot_{}".format('reads'))) )
 	logger.debug("...plotting {}".format('bases'))
-	lineplot_multi(bases_dfs, 
-				   "bases [{}]",
-				   os.path.join(input_dir, 'res', "plots", "multi_lineplot_{}".format('bases')),
-				   bases_scaling_factor,
-				   bases_unit)
+	plot_jobs.append( (lineplot_multi, (bases_dfs, 
+										"bases [{}]",
+										bases_scaling_factor,
+										bases_unit),
+					   os.path.join(input_dir, 'res', "plots", "multi_lineplot_{}".format('bases'))) )
+
+	#######
+
+	plot_options = {'width'	:	args.width,
+					'height':	args.height,
+					'dpi'	:	args.dpi,
+					'style'	:	args.matplotlib_style}
+	render_plots(plot_jobs, plot_options, args.plot_workers, os.path.join(input_dir, 'res', 'plots'))
 
 	#######
 
@@ -388,11 +462,8 @@ def main(args, input_dir):
 		pass
 
 	logger.info("Creating html file")
-	subset_grouped = df.groupby(['subset'])
-	subsets = list(pd.DataFrame(subset_grouped['bases'].count()).index)
-	
-	barcode_grouped = df.groupby(['barcode'])
-	barcodes = list(pd.DataFrame(barcode_grouped['bases'].count()).index)
+	subsets = sorted(set([subset for _,subset in indexes]))
+	barcodes = sorted(set([bc for bc,_ in indexes]))
 	
 	create_html(input_dir, stats_df, logdata, args.html_refresh_rate, barcodes, subsets)
 
@@ -441,13 +512,38 @@ def create_html(outdir, stats_df, logdata, html_refresh_rate, barcodes, subsets)
 		print(template.render(render_dict), file=outfile)
 	copyfile(os.path.join(resources_dir, 'style.css'), os.path.join(outdir, 'res', 'style.css'))
 
-def lineplot_multi(time_dfs_lbls, y_label, dest, y_scaling_factor, y_unit):
-	f = plt.figure()
-	fig = plt.gcf()
-	fig.set_size_inches(fig_width, fig_height)
-	fig.set_dpi(fig_dpi)
-	gs0 = gridspec.GridSpec(1, 1)
-	ax1 = plt.subplot(gs0[0, 0])
+def new_figure(options):
+	fig = Figure(figsize=(options['width'], options['height']), dpi=options['dpi'])
+	FigureCanvasAgg(fig)
+	return fig
+
+def render_plot(job):
+	plot_func, plot_args, dest, options = job
+	with matplotlib.style.context(options['style']):
+		plot_func(*plot_args, dest, options)
+
+def render_plots(plot_jobs, options, workers, plots_dir):
+	'''Renders plots given as tuples of a plot function, its arguments and the destination of
+	the plot, which is passed to the plot function after the arguments. Plots that were
+	already rendered from the same arguments and options are skipped. The remaining plots are 
+	distributed over a pool of worker processes if more than one worker is requested.'''
+	changed, manifest, fingerprints = filter_unchanged(plots_dir, plot_jobs, options)
+	logger.info("Rendering {} plots, {} plots are unchanged".format(len(changed), len(plot_jobs)-len(changed)))
+
+	jobs = [(plot_func, plot_args, dest, options) for plot_func, plot_args, dest in changed]
+	if workers > 1 and len(jobs) > 1:
+		with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+			for _ in executor.map(render_plot, jobs):
+				pass
+	else:
+		for job in jobs:
+			render_plot(job)
+	record_refresh(plots_dir, manifest, fingerprints, len(plot_jobs)-len(changed), len(changed))
+
+def lineplot_multi(time_dfs_lbls, y_label, y_scaling_factor, y_unit, dest, options):
+	fig = new_figure(options)
+	gs0 = fig.add_gridspec(1, 1)
+	ax1 = fig.add_subplot(gs0[0, 0])
 
 	for i, (time, df, lbl) in enumerate(time_dfs_lbls):
 		ax1.plot(time, df/y_scaling_factor, color='C{}'.format(i), label=lbl)
@@ -457,19 +553,15 @@ def lineplot_multi(time_dfs_lbls, y_label, dest, y_scaling_factor, y_unit):
 	ax1.legend(loc=2)
 	ax1.yaxis.grid(color="black", alpha=0.1)
 
-	plt.savefig(dest)
-	plt.close()
+	fig.savefig(dest)
 
-def lineplot_2y(time, bases, dest):
+def lineplot_2y(time, bases, dest, options):
 	y_bases = bases.expanding(1).sum()
 	y_reads = pd.DataFrame({'count':range(1,bases.size+1)})
 
-	f = plt.figure()
-	fig = plt.gcf()
-	fig.set_size_inches(fig_width, fig_height)
-	fig.set_dpi(fig_dpi)
-	gs0 = gridspec.GridSpec(1, 1)
-	ax1 = plt.subplot(gs0[0, 0])
+	fig = new_figure(options)
+	gs0 = fig.add_gridspec(1, 1)
+	ax1 = fig.add_subplot(gs0[0, 0])
 	ax2 = ax1.twinx()
 
 	ax1.set_ylabel('reads')
@@ -484,16 +576,12 @@ def lineplot_2y(time, bases, dest):
 	ax1.set_xlabel('sequencing time [h]')
 
 	#fig.tight_layout()
-	plt.savefig(dest)
-	plt.close()
+	fig.savefig(dest)
 
-def adapter_bin_barplots(stats_df, bcs, subset_l, subset_q, subset_p, dest):
-	f = plt.figure()
-	fig = plt.gcf()
-	fig.set_size_inches(fig_width, fig_height)
-	fig.set_dpi(fig_dpi)
-	gs0 = gridspec.GridSpec(1, 1)
-	ax1 = plt.subplot(gs0[0, 0])
+def adapter_bin_barplots(stats_df, bcs, subset_l, subset_q, subset_p, dest, options):
+	fig = new_figure(options)
+	gs0 = fig.add_gridspec(1, 1)
+	ax1 = fig.add_subplot(gs0[0, 0])
 
 	x = np.array(list(range(len(bcs)-1)))
 	max_val = float(stats_df.drop(['All'], axis=0)[['Mb']].max())
@@ -517,24 +605,18 @@ def adapter_bin_barplots(stats_df, bcs, subset_l, subset_q, subset_p, dest):
 	ax1.set_xticks(list(range(len(df))))
 	ax1.set_xticklabels(list(df.index), rotation=45)
 
-	plt.savefig(dest)
-	plt.close()
+	fig.savefig(dest)
 
-def barplot(bins, intervals, interval, dest):
-	reads = np.array([len(i) for i in bins])
-	bases = np.array([sum(i) for i in bins])
+def barplot(reads, bases, intervals, interval, dest, options):
 	reads_scaling_factor, reads_unit = choose_scaling_factor(np.max(reads), [10**6 ,10**3, 1], ['M', 'k', '-'])
 	bases_scaling_factor, bases_unit = choose_scaling_factor(np.max(bases), [10**9, 10**6, 10**3], ['Gb', 'Mb', 'kb'])
 	reads = reads/reads_scaling_factor
 	bases = bases/bases_scaling_factor
 	x = np.array(list(range(len(intervals)))) + 0.5
 
-	f = plt.figure()
-	fig = plt.gcf()
-	fig.set_size_inches(fig_width, fig_height)
-	fig.set_dpi(fig_dpi)
-	gs0 = gridspec.GridSpec(1, 1)
-	ax1 = plt.subplot(gs0[0, 0])
+	fig = new_figure(options)
+	gs0 = fig.add_gridspec(1, 1)
+	ax1 = fig.add_subplot(gs0[0, 0])
 	ax2 = ax1.twinx()
 
 	ax1.set_ylim([0, ceil_msp(max(reads))])
@@ -545,7 +627,7 @@ def barplot(bins, intervals, interval, dest):
 	ax2.yaxis.grid(color="black", alpha=0.1)
 	ax1.set_ylabel('reads [{}]'.format(reads_unit))
 	if max(reads) >= 1000.:
-		ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+		ax1.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 	ax2.set_ylabel('bases [{}]'.format(bases_unit))
 
 	ax1.set_xticks(list(range(len(intervals)+1)))
@@ -566,25 +648,19 @@ def barplot(bins, intervals, interval, dest):
 	ax2.legend(loc=1, bbox_to_anchor=(1., 0.92))
 
 	#fig.tight_layout()
-	plt.savefig(dest)
-	plt.close()
+	fig.savefig(dest)
 
 
-def gc_lineplot(bins, intervals, interval, dest):
-	reads = np.array([len(i) for i in bins])
-	bases = np.array([sum(i) for i in bins])
+def gc_lineplot(reads, bases, intervals, interval, dest, options):
 	reads_scaling_factor, reads_unit = choose_scaling_factor(np.max(reads), [10**6 ,10**3, 1], ['M', 'k', '-'])
 	bases_scaling_factor, bases_unit = choose_scaling_factor(np.max(bases), [10**9, 10**6, 10**3], ['Gb', 'Mb', 'kb'])
 	reads = reads/reads_scaling_factor
 	bases = bases/bases_scaling_factor
 	#x = np.array(list(range(len(intervals)))) + 0.5
 
-	f = plt.figure()
-	fig = plt.gcf()
-	fig.set_size_inches(fig_width, fig_height)
-	fig.set_dpi(fig_dpi)
-	gs0 = gridspec.GridSpec(1, 1)
-	ax1 = plt.subplot(gs0[0, 0])
+	fig = new_figure(options)
+	gs0 = fig.add_gridspec(1, 1)
+	ax1 = fig.add_subplot(gs0[0, 0])
 	ax2 = ax1.twinx()
 
 	ax1.plot([i+interval/2 for i in intervals], reads, color='C1', label='reads', linewidth=0.5)
@@ -597,23 +673,19 @@ def gc_lineplot(bins, intervals, interval, dest):
 
 	ax1.set_xlabel("G+C content ({} % bins)".format(interval))
 	if max(reads) >= 1000.:
-		ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+		ax1.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 
 	#fig.tight_layout()
-	plt.savefig(dest)
-	plt.close()
-
-def boxplot(bins, intervals, interval, ylabel, dest):
-	f = plt.figure()
-	fig = plt.gcf()
-	fig.set_size_inches(fig_width, fig_height)
-	fig.set_dpi(fig_dpi)
-	gs0 = gridspec.GridSpec(2, 1, width_ratios=[1], height_ratios=[0.3,1])
+	fig.savefig(dest)
+
+def boxplot(box_stats, intervals, interval, ylabel, dest, options):
+	fig = new_figure(options)
+	gs0 = fig.add_gridspec(2, 1, width_ratios=[1], height_ratios=[0.3,1])
 	gs0.update(wspace=0.05, hspace=0.05)
-	ax0 = plt.subplot(gs0[0, 0])
-	ax1 = plt.subplot(gs0[1, 0])
+	ax0 = fig.add_subplot(gs0[0, 0])
+	ax1 = fig.add_subplot(gs0[1, 0])
 
-	ax1.boxplot(bins, showfliers=False)
+	ax1.bxp(box_stats, showfliers=False)
 
 	ax1.set_xlabel("sequencing time [h]")
 	ax1.set_ylabel(ylabel)
@@ -627,21 +699,20 @@ def boxplot(bins, intervals, interval, ylabel, dest):
 		except:
 			pass
 	ax1.set_xticklabels(xticklabels)
-	ax1.set_xlim([0.5, len(bins)+0.5])
+	ax1.set_xlim([0.5, len(box_stats)+0.5])
 	ax1.tick_params(top=False, bottom=True, left=True, right=False,
 				   labeltop=False, labelbottom=True)
 	ax1.yaxis.grid(color="black", alpha=0.1)
-	if max([max(_bin) for _bin in bins if _bin]) >= 1000.:
-		ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+	if np.nanmax([stats['whishi'] for stats in box_stats]) >= 1000.:
+		ax1.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 	ax1.set_axisbelow(True)
 
-	#reads = [len(i) for i in bins]
-	reads = np.array([len(i) for i in bins])
+	reads = np.array([stats['count'] for stats in box_stats])
 	reads_scaling_factor, reads_unit = choose_scaling_factor(np.max(reads), [10**6 ,10**3, 1], ['M', 'k', '-'])
 	reads = reads/reads_scaling_factor
-	ax0.bar([i for i in range(len(bins))], reads, align='center', color='grey', width=0.4)
+	ax0.bar([i for i in range(len(box_stats))], reads, align='center', color='grey', width=0.4)
 
-	ax0.set_xlim([-0.5, len(bins)-0.5])
+	ax0.set_xlim([-0.5, len(box_stats)-0.5])
 	ax0.set_ylim([0,np.max(reads)*1.2])
 	#ax0.set_ylim([0,max(reads)*1.2])
 	ax0.tick_params(top=False, bottom=False, left=True, right=False,
@@ -649,52 +720,30 @@ def boxplot(bins, intervals, interval, ylabel, dest):
 	#ax0.set_ylabel("reads")
 	ax0.set_ylabel('reads [{}]'.format(reads_unit))
 	if max(reads) >= 1000.:
-		ax0.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+		ax0.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 	ax0.set_xticklabels([])
 	ax0.yaxis.grid(color="black", alpha=0.1)
 	ax0.set_axisbelow(True)
 
 	#fig.tight_layout()
-	plt.savefig(dest)
-	plt.close()
-
-def avgN50longest(series):
-	return series.nlargest(int(series.size/2)).mean()
+	fig.savefig(dest)
 
-def stats_table(df):
-	subgrouped = df.groupby(['barcode', 'subset'])
-	grouped = df.groupby(['barcode'])
+def stats_table(aggregates):
+	aggregates = expand_aggregates(aggregates)
 
 	# keys equal headers in html
-	subgrouped_output_df = pd.DataFrame(
-		OrderedDict((('reads',							subgrouped['bases'].count()), 
-					 ('Mb',								subgrouped['bases'].sum()/1000000.), 
-					 ('mean quality',					subgrouped['qual'].mean()), 
-					 ('mean G+C content [%]',			subgrouped['gc'].mean()),
-					 ('mean length [kb]',				subgrouped['bases'].mean()/1000.),
-					 ('median length [kb]' ,			subgrouped['bases'].median()/1000.),
-					 ('mean length longest N50 [kb]',	subgrouped['bases'].agg(avgN50longest)/1000.),
-					 ('longest [kb]',					subgrouped['bases'].max()/1000.)
+	output_df = pd.DataFrame(
+		OrderedDict((('reads',							aggregates['reads'].astype(int)), 
+					 ('Mb',								aggregates['bases']/1000000.), 
+					 ('mean quality',					aggregates['qual_sum']/aggregates['reads']), 
+					 ('mean G+C content [%]',			aggregates['gc_sum']/aggregates['reads']),
+					 ('mean length [kb]',				aggregates['bases']/aggregates['reads']/1000.),
+					 ('median length [kb]' ,			aggregates['lengths'].apply(lambda sketch: sketch.median())/1000.),
+					 ('mean length longest N50 [kb]',	aggregates['lengths'].apply(lambda sketch: sketch.mean_longest_half())/1000.),
+					 ('longest [kb]',					aggregates['longest']/1000.)
 					 )))
-	grouped_output_df = pd.DataFrame(
-		OrderedDict((('reads',							grouped['bases'].count()), 
-					 ('Mb',								grouped['bases'].sum()/1000000.), 
-					 ('mean quality',					grouped['qual'].mean()), 
-					 ('mean G+C content [%]',			grouped['gc'].mean()),
-					 ('mean length [kb]',				grouped['bases'].mean()/1000.),
-					 ('median length [kb]',				grouped['bases'].median()/1000.),
-					 ('mean length longest N50 [kb]',	grouped['bases'].agg(avgN50longest)/1000.),
-					 ('longest [kb]',					grouped['bases'].max()/1000.)
-					 )))
-
-	# concat both to one DataFrame, sorted by the indexes
-	index = pd.MultiIndex.from_tuples(list(zip(list(grouped_output_df.index), 
-											   ['all' for i in grouped_output_df.index])), 
-									  names=['barcode', 'subset'])
-	grouped_output_df.index = index
-	concat_res = pd.concat([subgrouped_output_df,grouped_output_df])
-	concat_res = concat_res.sort_index(level=['barcode', 'subset'])
-	return concat_res
+	output_df = output_df.sort_index(level=['barcode', 'subset'])
+	return output_df
 
 def make_html_table(df):
 	df = df.round(2)
@@ -706,34 +755,40 @@ def make_html_table(df):
 	html_table = html_table.replace(m.group(0), '<tr class="trhighlight"' + m.group(0)[3:])
 	return html_table
 
-def parse_stats(fps):
+def parse_stats(fps, sketch_error):
 	dfs = []
+	aggregates = []
 	for fp in fps:
-		df = pd.read_csv(fp, 
-						 sep='\t', 
-						 header=None, 
-						 names="id bases qual gc subset pore_num pore time barcode".split(" "), 
-						 usecols=[1,2,3,4,5,6,7,8],
-						 index_col=[7,3,5], # referes to usecols
-						 converters={'time':(lambda x: pd.Timestamp(x))},
-						 dtype={'qual':float, 'gc':float, 'bases':float})
-		dfs.append(df)
-	df = pd.concat(dfs)
+		df, agg = load_stats(fp, sketch_error)
+		if df is not None:
+			dfs.append(df)
+			aggregates.append(agg)
 
-	if df.empty:
+	if not dfs or all(df.empty for df in dfs):
 		logger.error("no data in csv file{} {}".format('s' if len(fps)>1 else '', fps))
 		exit(1)
+	df = pd.concat(dfs)
 
 	start_time = df['time'].min()
 	df['time'] = (df['time'] - start_time).dt.total_seconds()
 
-	index_all = pd.MultiIndex.from_tuples([('All',subset,pore) for barcode,subset,pore in df.index],
-										  names=['barcode', 'subset', 'pore'])
-	df_copy = df.copy()
-	df_copy.index = index_all
-	concat_df = pd.concat([df,df_copy])
+	return df, merge_aggregates(aggregates)
+
+class SubgroupView():
+	'''Provides the reads of each (barcode, subset) group, including the groups of the pseudo
+	barcode 'All', which contain the reads of all barcodes. The reads of the 'All' groups are 
+	selected from df when they are requested instead of being held in a second copy of df.'''
+	def __init__(self, df):
+		self.subgrouped = df.groupby(['barcode', 'subset'])
+		self.grouped_by_subset = df.groupby('subset')
+		self.indexes = sorted(list(self.subgrouped.groups.keys()) + 
+							  [('All', subset) for subset in self.grouped_by_subset.groups.keys()])
 
-	return concat_df
+	def get_group(self, name):
+		barcode, subset = name
+		if barcode == 'All':
+			return self.grouped_by_subset.get_group(subset)
+		return self.subgrouped.get_group(name)
 
 def choose_scaling_factor(max_value, scaling_factors, units):
 	for i,scaling_factor in enumerate(scaling_factors):
@@ -741,31 +796,6 @@ def choose_scaling_factor(max_value, scaling_factors, units):
 			return scaling_factor, units[i]
 	return scaling_factors[-1], units[-1]
 
-def get_lowest_possible_interval(intervals, max_bins, min_value, max_value):
-	interval = None
-	num_bins = None
-	for interval in intervals:
-		offset = min_value // interval
-		num_bins = ((max_value-(offset*interval)) // interval)+1
-		if num_bins <= max_bins:
-			interval = interval
-			break
-	if not interval:
-		interval = intervals[-1]
-	return interval, offset, int(num_bins)
-
-def get_bin_edges(sorted_df, interval):
-	offset = sorted_df[0] // interval
-	edge = sorted_df[0] + interval
-	edges = [0]
-
-	for i,val in enumerate(sorted_df):
-		while val > edge:
-			edges.append( i )
-			edge += interval
-	edges.append(sorted_df.size)
-	return edges
-
 def get_label(colomn_lbl):
 	if colomn_lbl.lower() == 'gc':
 		return 'G+C content'
@@ -775,12 +805,6 @@ def get_label(colomn_lbl):
 		return 'read length'
 	return colomn_lbl
 
-def get_bins(df, bin_edges):
-	bins = []
-	for i in range(1,len(bin_edges)):
-		bins.append(list(df[bin_edges[i-1]:bin_edges[i]]))
-	return bins
- 
 def get_subset_names(indexes):
 	subset_l, subset_q, subset_p, subset_a = None, None, None, None
 	for bc, subset in indexes:
@@ -803,6 +827,59 @@ def get_yticks(max_val, nticks=11):
 	tickspace = vmax/10
 	return np.arange(0, vmax+tickspace, tickspace)
 
+def get_input_mtime(input_dir):
+	'''Returns the latest modification time of the stats and logdata files in input_dir.'''
+	return max([os.path.getmtime(os.path.join(input_dir, f)) for f in os.listdir(input_dir) 
+				if f.endswith("_stats.csv") or f.endswith("_logdata.json")] + [0.])
+
+def is_up_to_date(input_dir):
+	report_fp = os.path.join(input_dir, 'report.html')
+	return os.path.exists(report_fp) and os.path.getmtime(report_fp) > get_input_mtime(input_dir)
+
+def batch_job(args, input_dir):
+	'''Creates the report of input_dir in a worker process of run_batch.'''
+	start = time.time()
+	try:
+		main(args, input_dir)
+		return {'directory':input_dir, 'status':'success', 'duration':time.time()-start}
+	except (Exception, SystemExit) as e:
+		error = traceback.format_exception_only(type(e), e)[-1].strip()
+		return {'directory':input_dir, 'status':'failed', 'duration':time.time()-start, 'error':error}
+
+def run_batch(args):
+	'''Creates the reports of all input directories in args.jobs worker processes, starting with
+	the most recently modified directories. Directories with an up-to-date report are skipped 
+	unless args.force is set.'''
+	input_dirs = sorted(args.input, key=get_input_mtime, reverse=True)
+	results = []
+	if not args.force:
+		for input_dir in list(input_dirs):
+			if is_up_to_date(input_dir):
+				results.append({'directory':input_dir, 'status':'skipped', 'duration':0.})
+				input_dirs.remove(input_dir)
+		logger.info("skipping {} directories with up-to-date reports".format(len(results)))
+	# plots are not rendered in parallel within a job, the jobs already use all workers
+	args.plot_workers = 1
+
+	start = time.time()
+	with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+		futures = [executor.submit(batch_job, args, input_dir) for input_dir in input_dirs]
+		for future in as_completed(futures):
+			result = future.result()
+			results.append(result)
+			if result['status'] == 'failed':
+				logger.warning("failed to create report for {}: {}".format(result['directory'], result['error']))
+			else:
+				logger.info("created report for {} in {:.1f} seconds".format(result['directory'], result['duration']))
+
+	counts = {status:len([r for r in results if r['status'] == status]) for status in ['success', 'failed', 'skipped']}
+	logger.info("processed {} directories in {:.1f} seconds: {} succeeded, {} failed, {} skipped".format(
+		len(results), time.time()-start, counts['success'], counts['failed'], counts['skipped']))
+	if args.summary:
+		with open(args.summary, 'w') as f:
+			print(json.dumps({'counts':counts, 'duration':time.time()-start, 'directories':results}, indent=4), file=f)
+	return counts['failed'] == 0
+
 def standalone():
 	global __name__
 	__name__ = '__main__'
@@ -811,12 +888,8 @@ def standalone():
 	logger.info("Start processing the following directories:")
 	logger.info("\n".join(args.input))
 	if args.recursive:
-		# use exception ahndling in case of recursive
-		for input_dir in args.input:
-			try:
-				main(args, input_dir)
-			except:
-				logger.warning("failed to create report for {}".format(input_dir))
+		if not run_batch(args):
+			exit(1)
 	else:
 		for input_dir in args.input:
 			main(args, input_dir)
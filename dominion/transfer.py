@@ -0,0 +1,329 @@
+"""
+Copyright 2018 Markus Haak (markus.haak@posteo.net)
+https://github.com/MarkusHaak/dominION
+
+This file is part of dominION. dominION is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. dominION is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with dominION. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import json
+import subprocess
+import tempfile
+import threading
+import logging
+from shutil import which
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
+# rsync exit code for files that vanished before they could be transferred
+RSYNC_VANISHED = 24
+# seconds a master ssh connection stays open after the last transfer
+CONTROL_PERSIST = 600
+# maximum number of bytes transferred by a single rsync call, progress is stored after each call
+MAX_BATCH_BYTES = 4 * 1024**3
+# priorities of files queued for transfer, lower values are transferred first
+PRIORITY_STATS = 0
+PRIORITY_READS = 1
+PRIORITY_RAW = 2
+MANIFEST_SUFFIX = '_transfer.json'
+# manifest fp : (size and mtime of the manifest, progress), see read_progress
+PROGRESS_CACHE = {}
+logger = logging.getLogger(name='gw.ts')
+
+def is_remote(dest):
+	'''rsync destinations of the form [USER@]HOST:DEST are remote, all others are local paths'''
+	return ':' in dest.split('/')[0]
+
+def split_path(fp):
+	'''Splits a path at the marker /./ that tells rsync -R which part of the path is recreated
+	at the destination. Paths without the marker are recreated completely.'''
+	if '/./' in fp:
+		root, relative_fp = fp.split('/./', 1)
+		return root or '/', os.path.normpath(relative_fp)
+	return '/', os.path.abspath(fp).lstrip('/')
+
+def join_path(root, relative_fp):
+	return '{}/./{}'.format(root.rstrip('/'), relative_fp)
+
+def file_state(fp):
+	try:
+		st = os.stat(fp)
+	except OSError:
+		return None
+	return (st.st_size, st.st_mtime_ns)
+
+def file_hash(fp):
+	'''Returns the xxh64 hash of a file or None if the xxhash module is not installed.'''
+	if xxhash is None:
+		return None
+	h = xxhash.xxh64()
+	with open(fp, 'rb') as f:
+		for block in iter(lambda: f.read(1024**2), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+class TransferManifest():
+	'''Persistent record of the files of a run that were queued for transfer and of the size,
+	modification time and optionally the hash of each file at the time its transfer was confirmed.
+	Files are identified by their path including the marker /./ used by rsync -R.'''
+	def __init__(self, fp=None):
+		self.fp = fp
+		self.files = {}		# path : [size, mtime, hash]
+		self.queued = {}	# path : size
+		self.archives = {}	# path : True if transferred completely
+		if fp and os.path.exists(fp):
+			try:
+				with open(fp, 'r') as f:
+					content = json.loads(f.read())
+				self.files = content['files']
+				self.queued = content['queued']
+				self.archives = content['archives']
+			except Exception:
+				logger.warning("transfer manifest {} is corrupt, all files of the run are transferred again".format(fp))
+
+	def is_confirmed(self, path, state):
+		return path in self.files and tuple(self.files[path][:2]) == state
+
+	def confirm(self, path, state, checksum=None):
+		self.files[path] = [state[0], state[1], checksum]
+		self.queued.pop(path, None)
+
+	def progress(self):
+		'''Returns the number of bytes confirmed as transferred and the total number of bytes of
+		all known files.'''
+		confirmed = sum(entry[0] for path, entry in self.files.items() if path not in self.queued)
+		return confirmed, confirmed + sum(self.queued.values())
+
+	def save(self):
+		if not self.fp:
+			return
+		with open(self.fp + '.tmp', 'w') as f:
+			print(json.dumps({'files'		:	self.files,
+							  'queued'		:	self.queued,
+							  'archives'	:	self.archives}), file=f)
+		os.replace(self.fp + '.tmp', self.fp)
+
+def read_progress(manifest_fp):
+	'''Returns the bytes transferred, the total bytes and whether all archives of a run were
+	transferred completely, or None if no manifest exists for the run. The result is cached until
+	the manifest file changes.'''
+	state = file_state(manifest_fp)
+	if state is None:
+		PROGRESS_CACHE.pop(manifest_fp, None)
+		return None
+	if manifest_fp in PROGRESS_CACHE and PROGRESS_CACHE[manifest_fp][0] == state:
+		return PROGRESS_CACHE[manifest_fp][1]
+	manifest = TransferManifest(manifest_fp)
+	confirmed, total = manifest.progress()
+	progress = (confirmed, total, bool(manifest.archives) and all(manifest.archives.values()))
+	PROGRESS_CACHE[manifest_fp] = (state, progress)
+	return progress
+
+
+class TransferScheduler(threading.Thread):
+	'''Transfers files queued by all watchnchop processes to the rsync destination. The queued
+	files are transferred at regular intervals with a single rsync call per source root, which
+	reuses one master ssh connection. The size and modification time of each transferred file are
+	stored in the transfer manifest of its run, such that files that did not change since their
+	last transfer are skipped without involving the remote host, even after a restart.'''
+	def __init__(self, rsync_dest, identity_file=None, interval=60, bwlimit=0, checksums=False, progress_callback=None):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.rsync_dest = rsync_dest
+		self.identity_file = identity_file
+		self.interval = interval
+		self.bwlimit = bwlimit
+		self.checksums = checksums
+		# called without arguments whenever files of a run were transferred
+		self.progress_callback = progress_callback
+		self.stoprequest = threading.Event()
+		self.lock = threading.RLock()
+		self.pending = {}		# (root, relative path) : (priority, manifest fp)
+		self.manifests = {None : TransferManifest()}
+		self.archives = {}		# (root, relative path) : manifest fp
+		if checksums and xxhash is None:
+			logger.warning("module xxhash is not installed, no checksums are stored in transfer manifests")
+
+	def ssh_command(self):
+		control_path = os.path.join(tempfile.gettempdir(), 'dominion_ssh_%r@%h:%p')
+		cmd = ['ssh',
+			   '-o', 'NumberOfPasswordPrompts=0',
+			   '-o', 'ControlMaster=auto',
+			   '-o', 'ControlPath={}'.format(control_path),
+			   '-o', 'ControlPersist={}'.format(CONTROL_PERSIST)]
+		if self.identity_file:
+			cmd.extend(['-i', self.identity_file])
+		return ' '.join(cmd)
+
+	def get_manifest(self, manifest_fp):
+		if manifest_fp not in self.manifests:
+			self.manifests[manifest_fp] = TransferManifest(manifest_fp)
+		return self.manifests[manifest_fp]
+
+	def queue(self, fp, priority=PRIORITY_READS, manifest_fp=None):
+		'''Queues a file for transfer. A marker /./ in fp splits it into the source root and the
+		relative path that is recreated at the destination, like in rsync -R.'''
+		key = split_path(fp)
+		state = file_state(os.path.join(*key))
+		if state is None:
+			return
+		with self.lock:
+			manifest = self.get_manifest(manifest_fp)
+			if manifest.is_confirmed(join_path(*key), state):
+				return
+			manifest.queued[join_path(*key)] = state[0]
+			if key in self.pending:
+				priority = min(priority, self.pending[key][0])
+			self.pending[key] = (priority, manifest_fp)
+
+	def queue_archive(self, fp, manifest_fp=None):
+		'''Queues all files below directory fp that changed since their last confirmed transfer.
+		Symbolic links to directories are followed. The archive is marked as transferred
+		completely in the manifest by the scheduler once all of its queued files are confirmed.'''
+		root, relative_dir = split_path(fp)
+		logger.info("queueing changed files of archive {}".format(fp))
+		for dirpath, dirnames, filenames in os.walk(os.path.join(root, relative_dir), followlinks=True):
+			for fn in filenames:
+				relative_fp = os.path.relpath(os.path.join(dirpath, fn), root)
+				self.queue(join_path(root, relative_fp), PRIORITY_RAW, manifest_fp)
+		with self.lock:
+			manifest = self.get_manifest(manifest_fp)
+			manifest.archives[join_path(root, relative_dir)] = False
+			manifest.save()
+			self.archives[(root, relative_dir)] = manifest_fp
+
+	def resume(self, runs_dir):
+		'''Queues the files of all runs in runs_dir that were queued but not transferred before
+		dominION was stopped, as well as changed files of archives not transferred completely.'''
+		for manifest_fp in glob.glob(os.path.join(runs_dir, '*', '*', '*' + MANIFEST_SUFFIX)):
+			with self.lock:
+				manifest = self.get_manifest(manifest_fp)
+				queued = list(manifest.queued)
+				incomplete = [path for path, complete in manifest.archives.items() if not complete]
+			for path in queued:
+				self.queue(path, PRIORITY_READS, manifest_fp)
+			for path in incomplete:
+				logger.info("resuming transfer of archive {}".format(path))
+				self.queue_archive(path, manifest_fp)
+
+	def update_archives(self):
+		'''Marks archives as transferred completely if the manifest contains no queued files of
+		the archive that were not confirmed yet. Only called by the scheduler thread, such that no
+		files of the archive are being transferred at the same time.'''
+		with self.lock:
+			for (root, relative_dir), manifest_fp in list(self.archives.items()):
+				archive = join_path(root, relative_dir)
+				manifest = self.get_manifest(manifest_fp)
+				prefix = os.path.join(archive, '')
+				if any(path.startswith(prefix) for path in manifest.queued):
+					continue
+				logger.info("archive {} was transferred completely".format(archive))
+				manifest.archives[archive] = True
+				manifest.save()
+				del self.archives[(root, relative_dir)]
+
+	def run(self):
+		logger.info("STARTED transfer scheduler for destination {}".format(self.rsync_dest))
+		while not self.stoprequest.wait(self.interval):
+			self.transfer_pending()
+		# transfer the files queued since the last interval
+		self.transfer_pending()
+		logger.info("STOPPED transfer scheduler")
+
+	def join(self, timeout=None):
+		self.stoprequest.set()
+		super(TransferScheduler, self).join(timeout)
+
+	def select_files(self, budget):
+		'''Removes the files that are transferred next from the pending files, up to budget bytes
+		in order of priority. Returns a dict of source roots and the selected files with their
+		state, priority and manifest.'''
+		with self.lock:
+			queued = sorted(self.pending.items(), key=lambda item: item[1][0])
+			selected = {}
+			for key, (priority, manifest_fp) in queued:
+				state = file_state(os.path.join(*key))
+				manifest = self.get_manifest(manifest_fp)
+				if state is None or manifest.is_confirmed(join_path(*key), state):
+					# vanished or unchanged since the last transfer
+					manifest.queued.pop(join_path(*key), None)
+					del self.pending[key]
+					continue
+				if selected and state[0] > budget:
+					break
+				budget -= state[0]
+				del self.pending[key]
+				selected.setdefault(key[0], {})[key[1]] = (state, priority, manifest_fp)
+		return selected
+
+	def transfer_pending(self):
+		'''Transfers the pending files with rsync calls of at most MAX_BATCH_BYTES bytes each. If
+		a bandwidth limit is set, only as many bytes as can be transferred within one interval are
+		transferred.'''
+		budget = self.bwlimit * 1024 * self.interval if self.bwlimit else None
+		while self.pending:
+			selected = self.select_files(MAX_BATCH_BYTES if budget is None else min(budget, MAX_BATCH_BYTES))
+			if not selected:
+				break
+			transferred = [self.transfer(root, files) for root, files in selected.items()]
+			if not all(transferred):
+				# the failed files are retried in the next interval
+				break
+			if budget is not None:
+				budget -= sum(state[0] for files in selected.values() for state, _, _ in files.values())
+				if budget <= 0:
+					break
+		self.update_archives()
+
+	def transfer(self, root, files):
+		'''Transfers files below root and confirms them in their manifests. Returns False if
+		rsync failed, in which case the files are pending again.'''
+		if not self.rsync(root, sorted(files)):
+			with self.lock:
+				for relative_fp, (state, priority, manifest_fp) in files.items():
+					self.pending.setdefault((root, relative_fp), (priority, manifest_fp))
+			return False
+		checksums = {}
+		if self.checksums:
+			for relative_fp in files:
+				checksums[relative_fp] = file_hash(os.path.join(root, relative_fp))
+		with self.lock:
+			changed = set()
+			for relative_fp, (state, priority, manifest_fp) in files.items():
+				self.get_manifest(manifest_fp).confirm(join_path(root, relative_fp), state, checksums.get(relative_fp))
+				changed.add(manifest_fp)
+			for manifest_fp in changed:
+				self.get_manifest(manifest_fp).save()
+		if self.progress_callback:
+			self.progress_callback()
+		return True
+
+	def rsync(self, root, relative_fps):
+		cmd = [which('nice') or 'nice', '-n', '19',
+			   'rsync', '-Rrkuv', '--partial', '--files-from=-']
+		if self.bwlimit:
+			cmd.append('--bwlimit={}'.format(self.bwlimit))
+		if is_remote(self.rsync_dest):
+			cmd.extend(['-e', self.ssh_command()])
+		cmd.extend([os.path.join(root, ''), self.rsync_dest])
+		logger.info("transferring {} files from {} to {}".format(len(relative_fps), root, self.rsync_dest))
+		try:
+			result = subprocess.run(cmd, input='\n'.join(relative_fps).encode(),
+									stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+		except OSError as e:
+			logger.error("rsync could not be started: {}".format(e))
+			return False
+		if result.returncode not in [0, RSYNC_VANISHED]:
+			logger.error("rsync failed with exit code {}: {}".format(result.returncode, result.stderr.decode(errors='replace').strip()))
+			return False
+		return True
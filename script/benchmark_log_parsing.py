@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the processing of MinKNOW log lines by dominion. Creates synthetic control server and
+bream log lines and compares parsing the timestamp of every line with dateutil, as done by
+previous versions of dominion, against the key word filter and fixed-layout timestamp parser used
+by dominion.dominion.LogFilesEventHandler.
+
+usage: python3 script/benchmark_log_parsing.py [-n LINES] [-r RELEVANT]
+"""
+
+import argparse
+import os
+import sys
+import time
+import queue
+import random
+from datetime import datetime, timedelta
+import dateutil.parser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dominion.dominion import LogFilesEventHandler
+
+SERVER_NOISE = ['    INFO: minion_status (control)\n    temperature = 34.1, bias_voltage = -180',
+				'    INFO: analyser_stats (analysis)\n    reads = 1234, bases = 5678901',
+				'    DEBUG: data_handler (engine)\n    channel = 231, state = strand',
+				'    INFO: heartbeat (control)']
+SERVER_RELEVANT = ['    INFO: pores available for sequencing (bream): has 1432 pores available for sequencing',
+				   '    INFO: [engine/info]: : flowcell_discovered (engine)\n    flowcell_id = FAK12345, asic_id_eeprom = 123']
+BREAM_NOISE = ['INFO - Device reading: temperature 34.1',
+			   'DEBUG - Channel states updated']
+BREAM_RELEVANT = ['INFO - Attribute sequencing_kit set to sqk-lsk109',
+				  'INFO - sequencing.start']
+
+def make_lines(n, relevant_fraction, seed=42):
+	rng = random.Random(seed)
+	start = datetime(2019, 1, 1, 10)
+	server_lines, bream_lines = [], []
+	for i in range(n):
+		timestamp = start + timedelta(milliseconds=137*i)
+		relevant = rng.random() < relevant_fraction
+		server = rng.choice(SERVER_RELEVANT if relevant else SERVER_NOISE)
+		bream = rng.choice(BREAM_RELEVANT if relevant else BREAM_NOISE)
+		server_lines.append(timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:23] + server)
+		bream_lines.append('bream.core - {} - {}'.format(timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:23], bream))
+	return server_lines, bream_lines
+
+def enqueue_with_dateutil(q, server_lines, bream_lines):
+	for line in server_lines:
+		q.put( (dateutil.parser.parse(line[:23]), 'server', line) )
+	for line in bream_lines:
+		q.put( (dateutil.parser.parse(line.split(' - ')[1]), 'bream', line) )
+
+def enqueue_with_handler(q, server_lines, bream_lines):
+	handler = LogFilesEventHandler(q, False, 0)
+	handler.activate_q()
+	for line in server_lines:
+		handler.enqueue_server_log_line(line)
+	for line in bream_lines:
+		handler.enqueue_bream_log_line(line)
+
+def timed(func, server_lines, bream_lines):
+	q = queue.PriorityQueue()
+	start = time.perf_counter()
+	func(q, server_lines, bream_lines)
+	return time.perf_counter() - start, q.qsize()
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark of MinKNOW log line processing in dominion')
+	parser.add_argument('-n', '--lines', type=int, default=200000, help='number of lines of each log file')
+	parser.add_argument('-r', '--relevant', type=float, default=0.001, help='fraction of lines containing key words')
+	args = parser.parse_args()
+
+	server_lines, bream_lines = make_lines(args.lines, args.relevant)
+	total = len(server_lines) + len(bream_lines)
+	results = []
+	for name, func in [('dateutil per line', enqueue_with_dateutil),
+					   ('filter and parser', enqueue_with_handler)]:
+		seconds, queued = timed(func, server_lines, bream_lines)
+		results.append(seconds)
+		print("{:<20} {:>8.2f} s {:>12,.0f} lines/s {:>8,} lines queued".format(name, seconds, total / seconds, queued))
+	print("speedup: {:.1f}x".format(results[0] / results[1]))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the timestamp parsing in statsparser. Creates a synthetic stats file and compares
+parsing it with a per-row pd.Timestamp converter, as done by previous versions of statsparser,
+against the bulk parsing of dominion.statscache.parse_stats_chunk.
+
+usage: python3 script/benchmark_parse_stats.py [-n ROWS] [-o STATS_FILE]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dominion.statscache import parse_stats_chunk
+
+def write_stats_file(fp, rows, seed=42):
+	rng = np.random.RandomState(seed)
+	chunk_size = 1000000
+	start = np.datetime64('2019-01-01T10:00:00', 's')
+	with open(fp, 'w') as f:
+		for first in range(0, rows, chunk_size):
+			n = min(chunk_size, rows - first)
+			read_numbers = np.arange(first, first + n)
+			lengths = rng.exponential(5000, n).astype(int) + 50
+			quals = np.round(rng.uniform(2, 14, n), 2)
+			gcs = np.round(rng.normal(50, 5, n), 2)
+			subsets = np.where(quals < 5, 'qual<5', np.where(lengths < 1000, 'length<1000', 'Passed'))
+			times = np.char.add(np.datetime_as_string(start + (read_numbers * 72 * 3600 // rows)), 'Z')
+			df = pd.DataFrame({'id'			:	np.char.add('read', read_numbers.astype(str)),
+							   'bases'		:	lengths,
+							   'qual'		:	quals,
+							   'gc'			:	gcs,
+							   'subset'		:	subsets,
+							   'pore_num'	:	read_numbers,
+							   'pore'		:	rng.randint(1, 513, n),
+							   'time'		:	times,
+							   'barcode'	:	rng.choice(['BC01', 'BC02', 'none'], n)})
+			df.to_csv(f, sep='\t', header=False, index=False)
+
+def parse_with_converter(buffer):
+	import io
+	return pd.read_csv(io.BytesIO(buffer),
+					   sep='\t',
+					   header=None,
+					   names="id bases qual gc subset pore_num pore time barcode".split(" "),
+					   usecols=[1,2,3,4,5,6,7,8],
+					   index_col=[7,3,5],
+					   converters={'time':(lambda x: pd.Timestamp(x))},
+					   dtype={'qual':float, 'gc':float, 'bases':float})
+
+def timed(func, buffer):
+	start = time.perf_counter()
+	df = func(buffer)
+	return time.perf_counter() - start, len(df)
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark of timestamp parsing in statsparser')
+	parser.add_argument('-n', '--rows', type=int, default=10000000, help='number of rows of the synthetic stats file')
+	parser.add_argument('-o', '--output', help='path of the synthetic stats file, which is kept if given')
+	args = parser.parse_args()
+
+	fp = args.output if args.output else os.path.join(tempfile.mkdtemp(), 'benchmark_stats.csv')
+	if not os.path.exists(fp):
+		print("writing {:,} rows to {}".format(args.rows, fp))
+		write_stats_file(fp, args.rows)
+	with open(fp, 'rb') as f:
+		buffer = f.read()
+
+	results = []
+	for name, func in [('per-row converter', parse_with_converter),
+					   ('bulk parsing', parse_stats_chunk)]:
+		seconds, rows = timed(func, buffer)
+		results.append(seconds)
+		print("{:<20} {:>8.2f} s {:>12,.0f} rows/s".format(name, seconds, rows / seconds))
+	print("speedup: {:.1f}x".format(results[0] / results[1]))
+
+	if not args.output:
+		os.remove(fp)
+		os.rmdir(os.path.dirname(fp))
+
+if __name__ == '__main__':
+	main()
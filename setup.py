@@ -55,5 +55,6 @@ setup(name='dominion',
 	  include_package_data=True,
 	  zip_safe=False,
 	  entry_points={"console_scripts": ['dominion = dominion.dominion:standalone',
-	  									'statsparser = dominion.statsparser:standalone']},
+	  									'statsparser = dominion.statsparser:standalone',
+	  									'fastqstats = dominion.fastqstats:standalone']},
 	  scripts=['bin/watchnchop'])
\ No newline at end of file